@@ -0,0 +1,113 @@
+"""
+Benchmark the detection server models on each CPU inference backend.
+
+For every backend variant this reports per-image latency (median / p95), frames per second
+and frames per second per core on a folder of real frames, and mAP50 / mAP50-95 when a
+labelled dataset yaml is given (e.g. the one train_yolo.py uses).
+
+Usage:
+    python benchmark_detectors.py --images static/footages --data dataset/data.yaml
+    python benchmark_detectors.py --variants torch onnx-int8 --weights yolov8n.pt
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+import cv2
+from detector_export import load_detector, IMAGE_EXTENSIONS
+
+VARIANTS = {
+    "torch": ("torch", False),
+    "onnx": ("onnx", False),
+    "onnx-int8": ("onnx", True),
+    "openvino": ("openvino", False),
+    "openvino-int8": ("openvino", True),
+}
+
+
+def load_frames(images_dir, limit):
+    frames = []
+    for path in sorted(os.listdir(images_dir)):
+        if path.lower().endswith(IMAGE_EXTENSIONS):
+            frame = cv2.imread(os.path.join(images_dir, path))
+            if frame is not None:
+                frames.append(frame)
+        if len(frames) >= limit:
+            break
+    if not frames:
+        raise SystemExit(f"No images found in {images_dir}")
+    return frames
+
+
+def measure_latency(model, frames, imgsz, warmup=3):
+    for frame in frames[:warmup]:
+        model.predict(frame, imgsz=imgsz, conf=0.01, iou=0.85, verbose=False)
+    timings = []
+    for frame in frames:
+        started = time.perf_counter()
+        model.predict(frame, imgsz=imgsz, conf=0.01, iou=0.85, verbose=False)
+        timings.append(time.perf_counter() - started)
+    timings = np.array(timings) * 1000
+    fps = 1000 / timings.mean()
+    return {
+        "latency_ms_median": round(float(np.median(timings)), 2),
+        "latency_ms_p95": round(float(np.percentile(timings, 95)), 2),
+        "fps": round(float(fps), 2),
+        "fps_per_core": round(float(fps / (os.cpu_count() or 1)), 3),
+    }
+
+
+def measure_accuracy(model, data, imgsz):
+    metrics = model.val(data=data, imgsz=imgsz, batch=1, plots=False, verbose=False)
+    return {"map50": round(float(metrics.box.map50), 4), "map50_95": round(float(metrics.box.map), 4)}
+
+
+def run_benchmark(weights, variants, images_dir, data=None, imgsz=1024, limit=50, calibration_dir=None):
+    frames = load_frames(images_dir, limit)
+    calibration_dir = calibration_dir or images_dir
+    rows = []
+    for weight in weights:
+        for variant in variants:
+            backend, int8 = VARIANTS[variant]
+            print(f"⏱️ {weight} on {variant}...", flush=True)
+            try:
+                model = load_detector(weight, backend, int8, calibration_dir)
+                row = {"weights": weight, "variant": variant, **measure_latency(model, frames, imgsz)}
+                if data:
+                    row.update(measure_accuracy(model, data, imgsz))
+            except Exception as e:  # Missing runtime (onnxruntime / openvino) should not abort the whole run
+                print(f"❌ {variant} failed: {e}")
+                row = {"weights": weight, "variant": variant, "error": str(e)}
+            rows.append(row)
+    return rows
+
+
+def print_table(rows):
+    columns = ["weights", "variant", "latency_ms_median", "latency_ms_p95", "fps", "fps_per_core", "map50", "map50_95"]
+    print("\n" + " | ".join(columns))
+    for row in rows:
+        if "error" in row:
+            print(f"{row['weights']} | {row['variant']} | error: {row['error']}")
+        else:
+            print(" | ".join(str(row.get(c, "-")) for c in columns))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare detector latency and mAP across CPU backends")
+    parser.add_argument("--weights", nargs="+", default=["best_custom.pt", "yolov8n.pt"])
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument("--images", default=os.path.join("static", "footages"), help="Frames used for latency")
+    parser.add_argument("--data", help="Labelled dataset yaml for mAP (skipped when omitted)")
+    parser.add_argument("--calibration", help="INT8 calibration images (defaults to --images)")
+    parser.add_argument("--imgsz", type=int, default=1024)
+    parser.add_argument("--limit", type=int, default=50, help="Number of frames to time")
+    parser.add_argument("--output", help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.weights, args.variants, args.images, args.data, args.imgsz, args.limit, args.calibration)
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✅ Results written to {args.output}")
@@ -0,0 +1,57 @@
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+from sqlalchemy.orm import Session
+import models
+
+
+def _insert_for(db: Session):
+    """Dialect-specific INSERT that supports ON CONFLICT upserts."""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def mark_dirty_pairs(db: Session, pairs: Iterable[Tuple[int, int]], reason: str):
+    """
+    Flag (product_id, location_id) pairs for the next incremental recommendation run.
+    Runs inside the caller's transaction, so the mark commits (or rolls back)
+    together with the change that caused it.
+    """
+    now = datetime.utcnow()
+    rows = [
+        {"product_id": int(p), "location_id": int(l), "reason": reason, "marked_at": now}
+        for p, l in set(pairs) if p is not None and l is not None
+    ]
+    if not rows:
+        return
+
+    insert = _insert_for(db)
+    stmt = insert(models.RecommendationDirtyPair)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["product_id", "location_id"],
+        set_={"reason": stmt.excluded.reason, "marked_at": stmt.excluded.marked_at}
+    )
+    db.execute(stmt, rows)
+
+
+def mark_dirty(db: Session, product_id: int, location_id: Optional[int], reason: str):
+    """
+    Flag one product-location pair. A missing location_id (e.g. a product-level
+    forecast or a product settings change) marks every location stocking the product.
+    """
+    if location_id is not None:
+        mark_dirty_pairs(db, [(product_id, location_id)], reason)
+        return
+
+    location_ids = db.query(models.Inventory.location_id).filter(
+        models.Inventory.product_id == product_id
+    ).all()
+    mark_dirty_pairs(db, [(product_id, l) for (l,) in location_ids], reason)
+
+
+def mark_all_inventory_dirty(db: Session, reason: str):
+    """Flag every stocked (product, location) pair, e.g. when the dirty-pair table is first created."""
+    pairs = db.query(models.Inventory.product_id, models.Inventory.location_id).all()
+    mark_dirty_pairs(db, pairs, reason)
@@ -0,0 +1,170 @@
+"""
+Export the YOLOv8 detectors to CPU inference runtimes and load them back.
+
+Backends:
+    torch     - PyTorch eager mode on the .pt weights (default)
+    onnx      - ONNX Runtime on a dynamic-shape ONNX export
+    openvino  - OpenVINO IR export
+
+With int8=True the exported graph is statically quantized with calibration images:
+ONNX Runtime QDQ quantization of the convolutions (the detection head stays float), or
+OpenVINO/NNCF post-training quantization. Artifacts are written next to the weights
+and reused until the weights change.
+
+Usage: python detector_export.py onnx --int8 --calibration static/footages/calibration
+"""
+import os
+import glob
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import cv2
+import yaml
+from ultralytics import YOLO
+
+BACKENDS = ("torch", "onnx", "openvino")
+EXPORT_IMGSZ = 1280  # Largest size the server infers at; dynamic exports also accept 640/1024
+CALIBRATION_IMAGES = 200  # Upper bound on images fed to the INT8 calibrator
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def artifact_path(weights: str, backend: str, int8: bool = False) -> str:
+    stem = os.path.splitext(weights)[0]
+    if backend == "onnx":
+        return f"{stem}.int8.onnx" if int8 else f"{stem}.onnx"
+    if backend == "openvino":
+        return f"{stem}_int8_openvino_model" if int8 else f"{stem}_openvino_model"
+    return weights
+
+
+def is_fresh(artifact: str, weights: str) -> bool:
+    return os.path.exists(artifact) and os.path.getmtime(artifact) >= os.path.getmtime(weights)
+
+
+def calibration_images(calibration_dir: str):
+    if not calibration_dir or not os.path.isdir(calibration_dir):
+        raise ValueError(f"INT8 export needs a directory of calibration images, got {calibration_dir!r}")
+    paths = sorted(
+        p for p in glob.glob(os.path.join(calibration_dir, "**", "*"), recursive=True)
+        if p.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    if not paths:
+        raise ValueError(f"No calibration images found in {calibration_dir}")
+    return paths[:CALIBRATION_IMAGES]
+
+
+def letterbox(image, size):
+    """Same centered 114-gray letterbox the server applies, as a (1, 3, size, size) float32 array"""
+    h, w = image.shape[:2]
+    ratio = min(size / h, size / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = int(round((size - new_w) / 2 - 0.1)), int(round((size - new_h) / 2 - 0.1))
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = resized
+    return np.ascontiguousarray(canvas[..., ::-1].transpose(2, 0, 1))[None].astype(np.float32) / 255
+
+
+def quantize_onnx(float_model: str, int8_model: str, calibration_dir: str, imgsz: int):
+    """Static QDQ quantization of the conv layers, calibrated on letterboxed sample images"""
+    from onnxruntime.quantization import (
+        CalibrationDataReader, QuantFormat, QuantType, CalibrationMethod, quantize_static
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+    import onnxruntime as ort
+
+    input_name = ort.InferenceSession(float_model, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    paths = calibration_images(calibration_dir)
+
+    class LetterboxReader(CalibrationDataReader):
+        def __init__(self):
+            self.paths = iter(paths)
+
+        def get_next(self):
+            for path in self.paths:
+                image = cv2.imread(path)
+                if image is not None:
+                    return {input_name: letterbox(image, imgsz)}
+            return None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prepared = os.path.join(tmp, "prepared.onnx")
+        quant_pre_process(float_model, prepared, skip_symbolic_shape=True)
+        quantize_static(
+            prepared,
+            int8_model,
+            LetterboxReader(),
+            quant_format=QuantFormat.QDQ,
+            op_types_to_quantize=["Conv"],  # Keeps the box/score decoding in float
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            calibrate_method=CalibrationMethod.MinMax,
+        )
+    print(f"✅ INT8 ONNX model written: {int8_model} ({len(paths)} calibration images)")
+
+
+def calibration_yaml(calibration_dir: str, names, folder: str) -> str:
+    """Minimal dataset yaml so the ultralytics OpenVINO exporter can calibrate on an image folder"""
+    calibration_images(calibration_dir)  # Fail early on an empty folder
+    path = os.path.join(folder, "calibration.yaml")
+    with open(path, "w") as f:
+        yaml.dump({
+            "path": os.path.abspath(calibration_dir),
+            "train": ".",
+            "val": ".",
+            "names": dict(names)
+        }, f)
+    return path
+
+
+def export_detector(weights: str, backend: str, int8: bool = False, calibration_dir: str = None,
+                    imgsz: int = EXPORT_IMGSZ, force: bool = False) -> str:
+    """Export weights for a backend (if the artifact is missing or stale) and return the artifact path"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend!r}, expected one of {BACKENDS}")
+    artifact = artifact_path(weights, backend, int8)
+    if backend == "torch" or (not force and is_fresh(artifact, weights)):
+        return artifact
+
+    print(f"📦 Exporting {weights} for {backend}{' INT8' if int8 else ''} at {imgsz}px...", flush=True)
+    model = YOLO(weights)
+    if backend == "onnx":
+        float_model = artifact_path(weights, "onnx")
+        if force or not is_fresh(float_model, weights):
+            exported = model.export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+            if os.path.abspath(exported) != os.path.abspath(float_model):
+                shutil.move(exported, float_model)
+        if int8:
+            quantize_onnx(float_model, artifact, calibration_dir, imgsz)
+        return artifact
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data = calibration_yaml(calibration_dir, model.names, tmp) if int8 else None
+        exported = model.export(format="openvino", imgsz=imgsz, dynamic=True, int8=int8, data=data)
+    if os.path.abspath(exported) != os.path.abspath(artifact):
+        shutil.rmtree(artifact, ignore_errors=True)
+        shutil.move(exported, artifact)
+    return artifact
+
+
+def load_detector(weights: str, backend: str = "torch", int8: bool = False, calibration_dir: str = None) -> YOLO:
+    """YOLO model served by the requested backend; exported models keep the .predict() interface"""
+    artifact = export_detector(weights, backend, int8, calibration_dir)
+    return YOLO(artifact, task="detect")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the detection server models for a CPU backend")
+    parser.add_argument("backend", choices=BACKENDS[1:])
+    parser.add_argument("--weights", nargs="+", default=["best_custom.pt", "yolov8n.pt"])
+    parser.add_argument("--int8", action="store_true", help="Statically quantize with calibration images")
+    parser.add_argument("--calibration", default=os.getenv("YOLO_CALIBRATION_DIR"), help="Folder of representative frames")
+    parser.add_argument("--imgsz", type=int, default=EXPORT_IMGSZ)
+    parser.add_argument("--force", action="store_true", help="Re-export even if the artifact is up to date")
+    args = parser.parse_args()
+
+    for weights in args.weights:
+        path = export_detector(weights, args.backend, args.int8, args.calibration, args.imgsz, args.force)
+        print(f"✅ {weights} -> {path}")
@@ -4,7 +4,9 @@ from contextlib import asynccontextmanager
 import uvicorn
 
 # Import database and models
-from database import engine, Base
+from database import engine, Base, SessionLocal, ensure_columns
+from sqlalchemy import inspect
+from change_tracking import mark_all_inventory_dirty
 import models
 from auth import initialize_firebase
 
@@ -36,7 +38,17 @@ async def lifespan(app: FastAPI):
     
     # Create database tables
     print("Creating database tables...")
+    had_dirty_pairs = inspect(engine).has_table(models.RecommendationDirtyPair.__tablename__)
     Base.metadata.create_all(bind=engine)
+    ensure_columns()
+    if not had_dirty_pairs:
+        # Upgraded database: no incremental run has seen any pair yet, so start with all of them dirty
+        db = SessionLocal()
+        try:
+            mark_all_inventory_dirty(db, "initial")
+            db.commit()
+        finally:
+            db.close()
     print("Database initialized")
     
     yield
@@ -3,7 +3,11 @@ import numpy as np
 from datetime import datetime, timedelta
 from sklearn.ensemble import RandomForestRegressor, IsolationForest
 from sklearn.preprocessing import StandardScaler
+from scipy import sparse
+from scipy.optimize import linprog
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Dict, Tuple, Optional
+from statistics import NormalDist
 import json
 import httpx
 import os
@@ -303,73 +307,818 @@ class ReplenishmentCalculator:
             'priority': priority
         }
 
+    @staticmethod
+    def calculate_reorder_quantities(
+        forecasted_demand: np.ndarray,
+        lead_time_demand: np.ndarray,
+        lead_time_variance: np.ndarray,
+        current_stock: np.ndarray,
+        safety_stock: np.ndarray,
+        service_level_z: float = 1.65
+    ) -> Dict[str, np.ndarray]:
+        """
+        Vectorized reorder calculation over a batch of product-location series.
+        Safety stock is raised to z * sigma of lead-time demand when the forecast
+        uncertainty calls for more than the configured level.
+        """
+        forecasted_demand = np.asarray(forecasted_demand, dtype=np.float64)
+        lead_time_demand = np.asarray(lead_time_demand, dtype=np.float64)
+        current_stock = np.asarray(current_stock, dtype=np.float64)
+
+        uncertainty_buffer = np.ceil(service_level_z * np.sqrt(np.maximum(lead_time_variance, 0.0)))
+        safety_stock = np.maximum(np.asarray(safety_stock, dtype=np.float64), uncertainty_buffer)
+
+        # ROP = Lead Time Demand + Safety Stock
+        reorder_point = np.floor(lead_time_demand + safety_stock)
+
+        # Reorder quantity = forecast + safety stock - current stock
+        reorder_qty = np.maximum(0.0, np.floor(forecasted_demand + safety_stock - current_stock))
+
+        priority = np.select(
+            [current_stock <= safety_stock, current_stock <= reorder_point, current_stock <= reorder_point * 1.5],
+            ["urgent", "high", "medium"],
+            default="low"
+        )
+
+        return {
+            'reorder_quantity': reorder_qty.astype(np.int64),
+            'reorder_point': reorder_point.astype(np.int64),
+            'safety_stock': safety_stock.astype(np.int64),
+            'lead_time_demand': lead_time_demand,
+            'priority': priority
+        }
+
+    @staticmethod
+    def apply_inventory_policies(
+        calc: Dict[str, np.ndarray],
+        current_stock: np.ndarray,
+        has_policy: np.ndarray,
+        policy_type: np.ndarray,
+        reorder_point: np.ndarray,
+        order_quantity: np.ndarray,
+        order_up_to: np.ndarray,
+        policy_safety_stock: np.ndarray = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Override the forecast-based result with stored (s, S) / (R, Q) policies where one exists:
+        at or below s, order up to S (sS) or the smallest multiple of Q that lifts stock above R (RQ).
+        The policy's safety stock, when stored, also replaces the forecast-derived one for priority.
+        """
+        current_stock = np.asarray(current_stock, dtype=np.float64)
+        s = np.nan_to_num(np.asarray(reorder_point, dtype=np.float64))
+        q = np.maximum(np.nan_to_num(np.asarray(order_quantity, dtype=np.float64)), 1.0)
+        S = np.asarray(order_up_to, dtype=np.float64)
+        S = np.where(np.isnan(S), s + q, S)
+
+        triggered = current_stock <= s
+        rq_qty = (np.floor((s - current_stock) / q) + 1) * q
+        policy_qty = np.where(triggered, np.where(policy_type == "RQ", rq_qty, S - current_stock), 0.0)
+
+        reorder_qty = np.where(has_policy, np.maximum(policy_qty, 0.0), calc['reorder_quantity'])
+        reorder_point = np.where(has_policy, s, calc['reorder_point'])
+        safety_stock = np.asarray(calc['safety_stock'], dtype=np.float64)
+        if policy_safety_stock is not None:
+            policy_ss = np.asarray(policy_safety_stock, dtype=np.float64)
+            safety_stock = np.where(has_policy & ~np.isnan(policy_ss), policy_ss, safety_stock)
+        priority = np.select(
+            [current_stock <= safety_stock, current_stock <= reorder_point, current_stock <= reorder_point * 1.5],
+            ["urgent", "high", "medium"],
+            default="low"
+        )
+
+        return {
+            **calc,
+            'reorder_quantity': reorder_qty.astype(np.int64),
+            'reorder_point': reorder_point.astype(np.int64),
+            'safety_stock': safety_stock.astype(np.int64),
+            'priority': priority
+        }
+
+
+class RebalancingOptimizer:
+    """
+    Cross-location transfer-versus-purchase allocation.
+    Each product is a small transportation problem: surplus locations ship to
+    locations below their reorder point, and purchases cover what is left.
+    Products are stacked block-diagonally so a whole chunk is one sparse LP,
+    and chunks are solved in parallel worker processes.
+    """
+
+    DONOR_COST_FACTOR = {"warehouse": 1.0, "distribution_center": 1.0, "store": 2.0}
+
+    def __init__(self, transfer_cost_ratio: float = 0.1, chunk_size: int = 500, max_workers: Optional[int] = None):
+        self.transfer_cost_ratio = transfer_cost_ratio
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+
+    def solve(
+        self,
+        product_ids: np.ndarray,
+        location_ids: np.ndarray,
+        location_types: np.ndarray,
+        requirement: np.ndarray,
+        available: np.ndarray,
+        unit_cost: np.ndarray
+    ) -> Dict[str, List[Dict]]:
+        """
+        Allocate every requirement from transfers or purchases.
+        Inputs are aligned per product-location row; requirement is the shortfall
+        to cover and available the surplus a location can give away.
+        """
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        location_ids = np.asarray(location_ids, dtype=np.int64)
+        requirement = np.maximum(np.floor(np.asarray(requirement, dtype=np.float64)), 0.0)
+        available = np.maximum(np.floor(np.asarray(available, dtype=np.float64)), 0.0)
+        purchase_cost = np.maximum(np.asarray(unit_cost, dtype=np.float64), 1.0)
+        donor_factor = np.array([self.DONOR_COST_FACTOR.get(t, 1.0) for t in location_types], dtype=np.float64)
+        transfer_cost = purchase_cost * self.transfer_cost_ratio * donor_factor
+
+        # Group rows by product; only products with both a shortfall and a surplus need the LP
+        order = np.argsort(product_ids, kind="stable")
+        sorted_products = product_ids[order]
+        starts = np.flatnonzero(np.r_[True, sorted_products[1:] != sorted_products[:-1]])
+        groups = np.split(order, starts[1:])
+
+        lp_groups = []
+        purchases = []
+        for rows in groups:
+            receivers = rows[requirement[rows] > 0]
+            if receivers.size == 0:
+                continue
+            donors = rows[available[rows] > 0]
+            if donors.size == 0:
+                purchases.extend(
+                    {"row": int(r), "quantity": int(requirement[r])} for r in receivers
+                )
+                continue
+            lp_groups.append((donors, receivers))
+
+        chunks = [
+            [(d, r, requirement[r], available[d], transfer_cost[d], purchase_cost[r]) for d, r in lp_groups[i:i + self.chunk_size]]
+            for i in range(0, len(lp_groups), self.chunk_size)
+        ]
+        if len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+                solved = list(pool.map(RebalancingOptimizer._solve_chunk, chunks))
+        else:
+            solved = [RebalancingOptimizer._solve_chunk(chunk) for chunk in chunks]
+
+        transfers = []
+        for chunk_result in solved:
+            transfers.extend(chunk_result["transfers"])
+            purchases.extend(chunk_result["purchases"])
+
+        return {
+            "transfers": [{
+                "product_id": int(product_ids[t["from_row"]]),
+                "from_location_id": int(location_ids[t["from_row"]]),
+                "to_location_id": int(location_ids[t["to_row"]]),
+                "from_row": t["from_row"],
+                "to_row": t["to_row"],
+                "quantity": t["quantity"]
+            } for t in transfers],
+            "purchases": [{
+                "product_id": int(product_ids[p["row"]]),
+                "location_id": int(location_ids[p["row"]]),
+                "row": p["row"],
+                "quantity": p["quantity"]
+            } for p in purchases]
+        }
+
+    @staticmethod
+    def _solve_chunk(problems: List[Tuple]) -> Dict[str, List[Dict]]:
+        """
+        Solve a chunk of per-product transportation problems as one block-diagonal LP.
+        Variables per product: donor x receiver transfers followed by receiver purchases.
+        """
+        costs, eq_rows, eq_cols, ub_rows, ub_cols = [], [], [], [], []
+        eq_rhs, ub_rhs = [], []
+        layout = []
+        var_offset = eq_offset = ub_offset = 0
+
+        for donors, receivers, req, avail, t_cost, p_cost in problems:
+            n_d, n_r = len(donors), len(receivers)
+            n_x = n_d * n_r
+            d_idx = np.repeat(np.arange(n_d), n_r)
+            r_idx = np.tile(np.arange(n_r), n_d)
+
+            costs.append(t_cost[d_idx])
+            costs.append(p_cost)
+            # Receiver balance: inbound transfers + purchase == requirement
+            eq_rows.append(eq_offset + np.r_[r_idx, np.arange(n_r)])
+            eq_cols.append(var_offset + np.arange(n_x + n_r))
+            eq_rhs.append(req)
+            # Donor capacity: outbound transfers <= surplus
+            ub_rows.append(ub_offset + d_idx)
+            ub_cols.append(var_offset + np.arange(n_x))
+            ub_rhs.append(avail)
+
+            layout.append((var_offset, donors, receivers, d_idx, r_idx, req))
+            var_offset += n_x + n_r
+            eq_offset += n_r
+            ub_offset += n_d
+
+        if var_offset == 0:
+            return {"transfers": [], "purchases": []}
+
+        eq_r, eq_c = np.concatenate(eq_rows), np.concatenate(eq_cols)
+        ub_r, ub_c = np.concatenate(ub_rows), np.concatenate(ub_cols)
+        A_eq = sparse.csr_matrix((np.ones(eq_r.size), (eq_r, eq_c)), shape=(eq_offset, var_offset))
+        A_ub = sparse.csr_matrix((np.ones(ub_r.size), (ub_r, ub_c)), shape=(ub_offset, var_offset))
+
+        result = linprog(
+            c=np.concatenate(costs),
+            A_ub=A_ub, b_ub=np.concatenate(ub_rhs),
+            A_eq=A_eq, b_eq=np.concatenate(eq_rhs),
+            bounds=(0, None),
+            method="highs"
+        )
+        if result.success:
+            solution = np.round(result.x)
+        else:
+            # Purchases are unbounded so the LP is always feasible; if the solver
+            # still fails, fall back to purchasing every shortfall
+            solution = np.zeros(var_offset)
+            for offset, donors, receivers, d_idx, r_idx, req in layout:
+                solution[offset + len(d_idx):offset + len(d_idx) + len(receivers)] = req
+
+        transfers, purchases = [], []
+        for offset, donors, receivers, d_idx, r_idx, _ in layout:
+            n_x = len(d_idx)
+            x = solution[offset:offset + n_x]
+            p = solution[offset + n_x:offset + n_x + len(receivers)]
+            for k in np.flatnonzero(x > 0):
+                transfers.append({
+                    "from_row": int(donors[d_idx[k]]),
+                    "to_row": int(receivers[r_idx[k]]),
+                    "quantity": int(x[k])
+                })
+            for k in np.flatnonzero(p > 0):
+                purchases.append({"row": int(receivers[k]), "quantity": int(p[k])})
+
+        return {"transfers": transfers, "purchases": purchases}
+
+
+class DemandSampler:
+    """
+    Daily demand scenario generator for one product, fitted once and reused.
+    Days covered by stored future forecasts are drawn from the forecast intervals;
+    the rest are block-bootstrapped from history in weekday-aligned 7-day blocks,
+    so weekly seasonality survives. Short histories fall back to a normal draw
+    around the mean.
+    """
+    
+    BLOCK_DAYS = 7
+    MIN_BOOTSTRAP_DAYS = 28
+    
+    def __init__(self, history: np.ndarray, forecast_mean: np.ndarray = None, forecast_std: np.ndarray = None):
+        self.history = np.asarray(history, dtype=np.float64)
+        self.forecast_mean = np.asarray(forecast_mean if forecast_mean is not None else [], dtype=np.float64)
+        self.forecast_std = np.asarray(forecast_std if forecast_std is not None else [], dtype=np.float64)
+        
+        # Block starts that fall on the same weekday as the first simulated day
+        n_history = self.history.size
+        self.block_starts = np.arange(n_history % self.BLOCK_DAYS, n_history - self.BLOCK_DAYS + 1, self.BLOCK_DAYS)
+        if n_history >= self.MIN_BOOTSTRAP_DAYS and self.block_starts.size:
+            self.method = "bootstrap"
+        else:
+            self.method = "normal"
+        if self.forecast_mean.size:
+            self.method = f"forecast+{self.method}"
+    
+    @classmethod
+    def fit(cls, sales_df: pd.DataFrame, forecast_df: Optional[pd.DataFrame] = None) -> 'DemandSampler':
+        """
+        sales_df: date, quantity_sold records, averaged per day to the per-record scale
+        ForecastingEngine predicts on (missing days count as zero).
+        forecast_df: forecast_date, predicted_quantity, upper_bound records; only the
+        contiguous run of days right after the last sale is used.
+        """
+        sales = sales_df.assign(day=pd.to_datetime(sales_df['date']).dt.normalize())
+        daily = sales.groupby('day')['quantity_sold'].mean()
+        daily = daily.reindex(pd.date_range(daily.index.min(), daily.index.max(), freq='D'), fill_value=0)
+        
+        forecast_mean = forecast_std = None
+        if forecast_df is not None and not forecast_df.empty:
+            fc = forecast_df.assign(day=pd.to_datetime(forecast_df['forecast_date']).dt.normalize())
+            fc = fc[fc['day'] > daily.index.max()]
+            if not fc.empty:
+                # ForecastingEngine intervals are prediction +/- 1.96 sigma
+                sigma = (fc['upper_bound'].fillna(fc['predicted_quantity']) - fc['predicted_quantity']) / 1.96
+                per_day = fc.assign(variance=sigma ** 2).groupby('day')[['predicted_quantity', 'variance']].mean()
+                horizon = pd.date_range(daily.index.max() + pd.Timedelta(days=1), per_day.index.max(), freq='D')
+                per_day = per_day.reindex(horizon)
+                gaps = np.flatnonzero(per_day['predicted_quantity'].isna().to_numpy())
+                per_day = per_day.iloc[:gaps[0] if gaps.size else len(per_day)]
+                forecast_mean = per_day['predicted_quantity'].to_numpy()
+                forecast_std = np.sqrt(per_day['variance'].to_numpy())
+        
+        return cls(daily.to_numpy(dtype=np.float64), forecast_mean, forecast_std)
+    
+    @property
+    def mean_daily_demand(self) -> float:
+        return float(self.history.mean()) if self.history.size else 0.0
+    
+    def sample(self, n_scenarios: int, simulation_days: int, rng: np.random.Generator = None) -> np.ndarray:
+        """Whole (scenarios x days) demand matrix in one call, truncated to whole units"""
+        rng = rng if rng is not None else np.random.default_rng()
+        
+        if self.method.endswith("bootstrap"):
+            n_blocks = -(-simulation_days // self.BLOCK_DAYS)
+            picks = self.block_starts[rng.integers(0, self.block_starts.size, size=(n_scenarios, n_blocks))]
+            index = (picks[:, :, None] + np.arange(self.BLOCK_DAYS)).reshape(n_scenarios, -1)[:, :simulation_days]
+            draws = self.history[index]
+        else:
+            avg = self.mean_daily_demand
+            draws = rng.normal(avg, avg * 0.2, size=(n_scenarios, simulation_days))
+        
+        horizon = min(self.forecast_mean.size, simulation_days)
+        if horizon:
+            draws[:, :horizon] = rng.normal(self.forecast_mean[:horizon], self.forecast_std[:horizon],
+                                            size=(n_scenarios, horizon))
+        return np.maximum(0, np.trunc(draws))
+    
+    def describe(self) -> Dict:
+        return {
+            'method': self.method,
+            'history_days': int(self.history.size),
+            'forecast_days': int(self.forecast_mean.size),
+            'mean_daily_demand': self.mean_daily_demand
+        }
+
 
 class SimulationEngine:
     """
     Run inventory strategy simulations
     """
     
+    HOLDING_COST_RATE = 0.01  # Per unit per day (simplified)
+    PERCENTILES = [5, 25, 50, 75, 95]
+    
+    @staticmethod
+    def _simulate_paths(
+        demand: np.ndarray,
+        initial_stock: float,
+        reorder_point,
+        reorder_quantity,
+        lead_time_days: int = 0,
+        lead_time_std: float = 0.0,
+        rng=None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Stock recursion vectorized across scenarios (rows of the demand matrix).
+        reorder_point / reorder_quantity may be scalars or per-scenario arrays.
+        
+        Orders placed at the end of day t arrive at the start of day t + lead time,
+        tracked in a ring buffer of outstanding quantities indexed by arrival day.
+        Reorder decisions use inventory position (on-hand + on-order) so stock
+        already in transit is not ordered twice. A lead time of 0 restocks the same day.
+        """
+        n_scenarios, simulation_days = demand.shape
+        reorder_point = np.broadcast_to(np.asarray(reorder_point, dtype=np.float64), (n_scenarios,))
+        reorder_quantity = np.broadcast_to(np.asarray(reorder_quantity, dtype=np.float64), (n_scenarios,))
+        lead_time_days = max(0, int(lead_time_days))
+        stochastic = lead_time_std > 0
+        if stochastic and rng is None:
+            rng = np.random.default_rng()
+        max_lead_time = int(np.ceil(lead_time_days + 4 * lead_time_std)) if stochastic else lead_time_days
+        
+        # Day-major buffers keep each day's slice contiguous
+        demand_by_day = np.ascontiguousarray(demand.T, dtype=np.float64)
+        stock = np.full(n_scenarios, float(initial_stock))
+        on_order = np.zeros(n_scenarios)
+        pipeline = np.zeros((max_lead_time + 1, n_scenarios))
+        stock_levels = np.empty((simulation_days, n_scenarios))
+        in_transit = np.empty((simulation_days, n_scenarios))
+        stockout = np.empty((simulation_days, n_scenarios), dtype=bool)
+        orders = np.zeros(n_scenarios, dtype=np.int64)
+        
+        for day in range(simulation_days):
+            # Receive everything due today
+            slot = day % pipeline.shape[0]
+            arrivals = pipeline[slot]
+            stock += arrivals
+            on_order -= arrivals
+            arrivals[:] = 0.0
+            
+            daily_demand = demand_by_day[day]
+            
+            # Unmet demand is lost and the shelf is emptied
+            short = np.less(stock, daily_demand, out=stockout[day])
+            stock -= daily_demand
+            stock[short] = 0.0
+            
+            # Check if need to reorder against inventory position
+            reorder = stock + on_order <= reorder_point
+            orders += reorder
+            placed = reorder_quantity * reorder
+            
+            if stochastic:
+                lead_times = np.clip(np.rint(rng.normal(lead_time_days, lead_time_std, size=n_scenarios)), 0, max_lead_time).astype(np.int64)
+                same_day = lead_times == 0
+                stock[same_day] += placed[same_day]
+                later = np.flatnonzero(reorder & ~same_day)
+                pipeline[(day + lead_times[later]) % pipeline.shape[0], later] += placed[later]
+                on_order[later] += placed[later]
+            elif lead_time_days == 0:
+                stock += placed
+            else:
+                pipeline[(day + lead_time_days) % pipeline.shape[0]] += placed
+                on_order += placed
+            
+            stock_levels[day] = stock
+            in_transit[day] = on_order
+        
+        return {
+            'stock_levels': stock_levels.T,
+            'in_transit': in_transit.T,
+            'stockout': stockout.T,
+            'orders': orders
+        }
+    
     @staticmethod
     def run_simulation(
-        sales_df: pd.DataFrame,
+        sales_df: Optional[pd.DataFrame],
         initial_stock: int,
         reorder_point: int,
         reorder_quantity: int,
         lead_time_days: int,
-        simulation_days: int = 90
+        simulation_days: int = 90,
+        lead_time_std: float = 0.0,
+        seed: Optional[int] = None,
+        sampler: Optional[DemandSampler] = None
     ) -> Dict:
         """
         Simulate inventory levels over time
         """
-        df = sales_df.copy()
-        df['date'] = pd.to_datetime(df['date'])
-        df = df.sort_values('date')
+        rng = np.random.default_rng(seed)
+        sampler = sampler or DemandSampler.fit(sales_df)
+        demand = sampler.sample(1, simulation_days, rng)
+        paths = SimulationEngine._simulate_paths(
+            demand, initial_stock, reorder_point, reorder_quantity,
+            lead_time_days=lead_time_days, lead_time_std=lead_time_std, rng=rng
+        )
         
-        # Calculate average daily demand
-        avg_daily_demand = df['quantity_sold'].mean()
+        stock_levels = paths['stock_levels'][0]
+        stockout_days = int(paths['stockout'][0].sum())
         
-        # Simulation
-        current_stock = initial_stock
-        total_orders = 0
-        stockout_days = 0
-        total_holding_cost = 0
+        return {
+            'total_orders': int(paths['orders'][0]),
+            'stockout_days': stockout_days,
+            'avg_stock_level': float(stock_levels.mean()),
+            'total_holding_cost': float(stock_levels.sum() * SimulationEngine.HOLDING_COST_RATE),
+            'service_level': (simulation_days - stockout_days) / simulation_days * 100,
+            'seed': seed,
+            'demand_model': sampler.describe(),
+            # Full daily series as arrays; stored as a compressed side record, not in the JSON summary
+            'trajectory': {
+                'stock_level': stock_levels.astype(np.int32),
+                'in_transit': paths['in_transit'][0].astype(np.int32),
+                'demand': demand[0].astype(np.int32)
+            }
+        }
+    
+    @staticmethod
+    def run_monte_carlo(
+        sales_df: Optional[pd.DataFrame],
+        initial_stock: int,
+        reorder_point: int,
+        reorder_quantity: int,
+        lead_time_days: int,
+        simulation_days: int = 90,
+        n_scenarios: int = 1000,
+        seed: Optional[int] = None,
+        lead_time_std: float = 0.0,
+        sampler: Optional[DemandSampler] = None
+    ) -> Dict:
+        """
+        Simulate many demand scenarios at once and summarize the outcome distributions
+        """
+        rng = np.random.default_rng(seed)
+        sampler = sampler or DemandSampler.fit(sales_df)
+        demand = sampler.sample(n_scenarios, simulation_days, rng)
+        paths = SimulationEngine._simulate_paths(
+            demand, initial_stock, reorder_point, reorder_quantity,
+            lead_time_days=lead_time_days, lead_time_std=lead_time_std, rng=rng
+        )
         
-        results = []
+        stock_levels = paths['stock_levels']
+        stockout_days = paths['stockout'].sum(axis=1)
+        service_level = (simulation_days - stockout_days) / simulation_days * 100
+        holding_cost = stock_levels.sum(axis=1) * SimulationEngine.HOLDING_COST_RATE
+        percentiles = SimulationEngine.PERCENTILES
         
-        for day in range(simulation_days):
-            # Daily demand (use average with some randomness)
-            daily_demand = max(0, int(np.random.normal(avg_daily_demand, avg_daily_demand * 0.2)))
-            
-            # Check stock
-            if current_stock >= daily_demand:
-                current_stock -= daily_demand
-            else:
-                stockout_days += 1
-                current_stock = 0
-            
-            # Check if need to reorder
-            if current_stock <= reorder_point:
-                current_stock += reorder_quantity
-                total_orders += 1
-            
-            # Holding cost (simplified)
-            total_holding_cost += current_stock * 0.01
-            
-            results.append({
-                'day': day,
-                'stock_level': current_stock,
-                'demand': daily_demand
-            })
+        def distribution(values: np.ndarray) -> Dict:
+            return {
+                'mean': float(values.mean()),
+                **{f'p{p}': float(v) for p, v in zip(percentiles, np.percentile(values, percentiles))}
+            }
         
+        bands = np.percentile(stock_levels, percentiles, axis=0)
         return {
-            'total_orders': total_orders,
-            'stockout_days': stockout_days,
-            'avg_stock_level': np.mean([r['stock_level'] for r in results]),
-            'total_holding_cost': total_holding_cost,
-            'service_level': (simulation_days - stockout_days) / simulation_days * 100,
-            'daily_results': results[:30]  # Return first 30 days for visualization
+            'mode': 'monte_carlo',
+            'n_scenarios': n_scenarios,
+            'seed': seed,
+            'demand_model': sampler.describe(),
+            'service_level': distribution(service_level),
+            'stockout_probability': float((stockout_days > 0).mean()),
+            'daily_stockout_probability': float(paths['stockout'].mean()),
+            'expected_holding_cost': float(holding_cost.mean()),
+            'holding_cost': distribution(holding_cost),
+            'expected_orders': float(paths['orders'].mean()),
+            'avg_stock_level': float(stock_levels.mean()),
+            'avg_in_transit': float(paths['in_transit'].mean()),
+            # Full-length daily percentile bands; stored as a compressed side record
+            'trajectory': {
+                **{f'stock_p{p}': band.astype(np.float32) for p, band in zip(percentiles, bands)},
+                'stock_mean': stock_levels.mean(axis=0).astype(np.float32),
+                'in_transit_mean': paths['in_transit'].mean(axis=0).astype(np.float32),
+                'stockout_probability': paths['stockout'].mean(axis=0).astype(np.float32)
+            }
         }
 
+    @staticmethod
+    def _evaluate_policies(
+        demand: np.ndarray,
+        initial_stock: int,
+        reorder_points: np.ndarray,
+        reorder_quantities: np.ndarray,
+        lead_time_days: int,
+        lead_time_std: float,
+        ordering_cost: float,
+        seed: Optional[int]
+    ) -> Dict[str, np.ndarray]:
+        """
+        Score a batch of (reorder_point, reorder_quantity) candidates against the
+        same demand scenarios by stacking candidates x scenarios into one simulation.
+        """
+        n_candidates = len(reorder_points)
+        n_scenarios, simulation_days = demand.shape
+        paths = SimulationEngine._simulate_paths(
+            np.tile(demand, (n_candidates, 1)),
+            initial_stock,
+            np.repeat(reorder_points, n_scenarios),
+            np.repeat(reorder_quantities, n_scenarios),
+            lead_time_days=lead_time_days,
+            lead_time_std=lead_time_std,
+            rng=np.random.default_rng(seed)
+        )
+        
+        stockout_days = paths['stockout'].sum(axis=1).reshape(n_candidates, n_scenarios)
+        holding_cost = (paths['stock_levels'].sum(axis=1) * SimulationEngine.HOLDING_COST_RATE).reshape(n_candidates, n_scenarios)
+        orders = paths['orders'].reshape(n_candidates, n_scenarios)
+        return {
+            'service_level': ((simulation_days - stockout_days) / simulation_days * 100).mean(axis=1),
+            'stockout_probability': (stockout_days > 0).mean(axis=1),
+            'holding_cost': holding_cost.mean(axis=1),
+            'orders': orders.mean(axis=1),
+            'total_cost': (holding_cost + orders * ordering_cost).mean(axis=1)
+        }
+    
+    @staticmethod
+    def run_sweep(
+        sales_df: Optional[pd.DataFrame],
+        initial_stock: int,
+        reorder_points: List[int],
+        reorder_quantities: List[int],
+        lead_time_days: int,
+        simulation_days: int = 90,
+        n_scenarios: int = 200,
+        seed: Optional[int] = None,
+        lead_time_std: float = 0.0,
+        ordering_cost: float = 0.0,
+        max_workers: Optional[int] = None,
+        sampler: Optional[DemandSampler] = None
+    ) -> Dict:
+        """
+        Evaluate every (reorder_point, reorder_quantity) pair of the grid on one
+        shared demand-sample matrix, in parallel chunks, and return the
+        cost vs. service-level Pareto frontier.
+        """
+        rng = np.random.default_rng(seed)
+        sampler = sampler or DemandSampler.fit(sales_df)
+        demand = sampler.sample(n_scenarios, simulation_days, rng)
+        
+        grid_rop, grid_roq = np.meshgrid(np.asarray(reorder_points, dtype=np.float64),
+                                         np.asarray(reorder_quantities, dtype=np.float64), indexing='ij')
+        grid_rop, grid_roq = grid_rop.ravel(), grid_roq.ravel()
+        
+        # Keep each chunk's stacked simulation around 100k paths
+        chunk_size = max(1, SWEEP_PATHS_PER_CHUNK // n_scenarios)
+        chunks = [
+            (grid_rop[i:i + chunk_size], grid_roq[i:i + chunk_size], initial_stock, lead_time_days,
+             lead_time_std, ordering_cost, None if seed is None else seed + 1 + i)
+            for i in range(0, grid_rop.size, chunk_size)
+        ]
+        if len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_sweep_worker, initargs=(demand,)) as pool:
+                scored = list(pool.map(_run_sweep_chunk, chunks))
+        else:
+            _init_sweep_worker(demand)
+            scored = [_run_sweep_chunk(chunk) for chunk in chunks]
+        
+        metrics = {key: np.concatenate([s[key] for s in scored]) for key in scored[0]}
+        candidates = [{
+            'reorder_point': int(grid_rop[i]),
+            'reorder_quantity': int(grid_roq[i]),
+            'service_level': float(metrics['service_level'][i]),
+            'stockout_probability': float(metrics['stockout_probability'][i]),
+            'holding_cost': float(metrics['holding_cost'][i]),
+            'expected_orders': float(metrics['orders'][i]),
+            'total_cost': float(metrics['total_cost'][i])
+        } for i in range(grid_rop.size)]
+        
+        # Pareto frontier: walking up in cost, keep candidates that raise the best service level
+        frontier = []
+        best_service = -np.inf
+        for i in np.lexsort((-metrics['service_level'], metrics['total_cost'])):
+            if metrics['service_level'][i] > best_service:
+                frontier.append(candidates[i])
+                best_service = metrics['service_level'][i]
+        
+        return {
+            'n_candidates': len(candidates),
+            'n_scenarios': n_scenarios,
+            'simulation_days': simulation_days,
+            'seed': seed,
+            'demand_model': sampler.describe(),
+            'frontier': frontier,
+            'candidates': candidates
+        }
+
+
+SWEEP_PATHS_PER_CHUNK = 100_000
+_sweep_demand = None
+
+
+def _init_sweep_worker(demand: np.ndarray):
+    """Process-pool initializer: ship the shared demand matrix to each worker once."""
+    global _sweep_demand
+    _sweep_demand = demand
+
+
+def _run_sweep_chunk(chunk: Tuple) -> Dict[str, np.ndarray]:
+    reorder_points, reorder_quantities, initial_stock, lead_time_days, lead_time_std, ordering_cost, seed = chunk
+    return SimulationEngine._evaluate_policies(
+        _sweep_demand, initial_stock, reorder_points, reorder_quantities,
+        lead_time_days, lead_time_std, ordering_cost, seed
+    )
+
+
+class PolicyOptimizer:
+    """
+    Catalog-wide (s, S) or (R, Q) inventory policies.
+    Every series gets the analytic normal-approximation policy; series where that
+    approximation is weak (slow movers, erratic demand) are refined by sampling
+    replenishment cycles for all of them at once. service_level is a cycle service
+    level on both paths: the share of replenishment cycles without a stockout.
+    """
+    
+    def __init__(
+        self,
+        service_level: float = 0.95,
+        policy_type: str = "sS",
+        ordering_cost: float = 50.0,
+        holding_rate: float = 0.25,
+        n_scenarios: int = 1000,
+        chunk_size: int = 2000,
+        max_workers: Optional[int] = None,
+        seed: int = 42
+    ):
+        if policy_type not in ("sS", "RQ"):
+            raise ValueError("policy_type must be 'sS' or 'RQ'")
+        self.service_level = service_level
+        self.policy_type = policy_type
+        self.ordering_cost = ordering_cost  # Fixed cost per order
+        self.holding_rate = holding_rate  # Annual holding cost as a fraction of unit cost
+        self.n_scenarios = n_scenarios  # Sampled replenishment cycles per refined series
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.seed = seed
+    
+    def optimize(
+        self,
+        mean_daily_demand: np.ndarray,
+        demand_std: np.ndarray,
+        lead_time_days: np.ndarray,
+        unit_cost: np.ndarray
+    ) -> Dict[str, np.ndarray]:
+        """
+        Policies for aligned per-series arrays. Returns reorder_point (s / R),
+        order_quantity (Q), order_up_to (S), safety_stock, expected_service_level
+        and whether each row was simulation-refined.
+        """
+        inputs = [np.asarray(a, dtype=np.float64) for a in (mean_daily_demand, demand_std, lead_time_days, unit_cost)]
+        settings = (self.service_level, self.ordering_cost, self.holding_rate, self.n_scenarios)
+        chunks = [
+            (settings, self.seed + i, *[a[i:i + self.chunk_size] for a in inputs])
+            for i in range(0, inputs[0].size, self.chunk_size)
+        ]
+        if len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+                solved = list(pool.map(_optimize_policy_chunk, chunks))
+        else:
+            solved = [_optimize_policy_chunk(chunk) for chunk in chunks]
+        
+        if not solved:
+            return {}
+        policies = {key: np.concatenate([s[key] for s in solved]) for key in solved[0]}
+        policies["order_up_to"] = policies["reorder_point"] + policies["order_quantity"]
+        policies["policy_type"] = np.full(policies["reorder_point"].size, self.policy_type, dtype=object)
+        return policies
+    
+    FALLBACK_COVER_DAYS = 30  # Order quantity in days of demand when EOQ has no unit cost to work with
+    
+    @staticmethod
+    def analytic_policy(mean, std, lead_time_days, unit_cost, z, ordering_cost, holding_rate) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        s = mean*L + z*std*sqrt(L)
+        Q = EOQ = sqrt(2 * annual demand * ordering cost / (holding rate * unit cost)),
+        or FALLBACK_COVER_DAYS of demand when the unit cost is 0 or missing
+        """
+        lead_time_demand = mean * lead_time_days
+        safety_stock = z * std * np.sqrt(lead_time_days)
+        reorder_point = np.ceil(lead_time_demand + safety_stock)
+        priced = np.isfinite(unit_cost) & (unit_cost > 0)
+        holding_cost = holding_rate * np.where(priced, unit_cost, 1.0)
+        eoq = np.sqrt(2 * mean * 365 * ordering_cost / holding_cost)
+        order_quantity = np.maximum(1.0, np.ceil(np.where(priced, eoq, mean * PolicyOptimizer.FALLBACK_COVER_DAYS)))
+        return reorder_point, order_quantity
+    
+    @staticmethod
+    def needs_refinement(mean, std, lead_time_days) -> np.ndarray:
+        """Normal approximation is unreliable for slow movers and very erratic demand"""
+        return (mean > 0) & ((mean * lead_time_days < 10) | (std > mean))
+    
+    @staticmethod
+    def sample_cycle_demand(mean, std, lead_time_days, n_scenarios: int, rng) -> np.ndarray:
+        """
+        Demand the reorder point has to cover in sampled replenishment cycles, shape
+        (series, n_scenarios): the undershoot below s on the day the order is triggered
+        plus demand over the lead time. Daily demand is Poisson, or gamma-Poisson
+        (negative binomial) when over-dispersed, so lead-time demand is drawn in one step.
+        """
+        mean, std, lead_time_days = (np.asarray(a, dtype=np.float64)[:, None] for a in (mean, std, lead_time_days))
+        size = (mean.shape[0], n_scenarios)
+        variance = np.maximum(std ** 2, mean)
+        dispersed = variance > mean * 1.05
+        shape = np.where(dispersed, mean ** 2 / np.where(dispersed, variance - mean, 1.0), 1.0)
+        scale = mean / shape
+        
+        # Sum of L gamma-Poisson days is Poisson with a Gamma(L * shape) rate
+        lead_rate = np.where(dispersed, rng.gamma(np.maximum(lead_time_days * shape, 1e-9), scale, size=size), mean * lead_time_days)
+        # Crossing day demand is size-biased (1 + draw with shape + 1); the undershoot is uniform below it
+        crossing_rate = np.where(dispersed, rng.gamma(shape + 1, scale, size=size), mean)
+        undershoot = np.floor(rng.random(size) * (1 + rng.poisson(crossing_rate)))
+        return rng.poisson(lead_rate) + undershoot
+    
+    @staticmethod
+    def refine_reorder_points(
+        mean: np.ndarray,
+        std: np.ndarray,
+        lead_time_days: np.ndarray,
+        target_service: float,
+        n_scenarios: int,
+        rng
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Cycle-service reorder points for a stack of series: the smallest integer s for
+        which the target share of sampled replenishment cycles is stockout-free, the same
+        measure the analytic z-score approximates. Returns (reorder_point, service_level).
+        """
+        cycle_demand = PolicyOptimizer.sample_cycle_demand(mean, std, lead_time_days, n_scenarios, rng)
+        reorder_point = np.quantile(cycle_demand, target_service, axis=1, method='inverted_cdf')
+        service = (cycle_demand <= reorder_point[:, None]).mean(axis=1)
+        return reorder_point, service
+
+
+def _optimize_policy_chunk(chunk: Tuple) -> Dict[str, np.ndarray]:
+    """Analytic policies for a chunk of series, refined by simulation where needed"""
+    settings, seed, mean, std, lead_time_days, unit_cost = chunk
+    service_level, ordering_cost, holding_rate, n_scenarios = settings
+    z = NormalDist().inv_cdf(service_level)
+    
+    reorder_point, order_quantity = PolicyOptimizer.analytic_policy(
+        mean, std, lead_time_days, unit_cost, z, ordering_cost, holding_rate
+    )
+    expected_service = np.full(mean.size, service_level)
+    refined = PolicyOptimizer.needs_refinement(mean, std, lead_time_days)
+    
+    if refined.any():
+        reorder_point[refined], expected_service[refined] = PolicyOptimizer.refine_reorder_points(
+            mean[refined], std[refined], lead_time_days[refined],
+            service_level, n_scenarios, np.random.default_rng(seed)
+        )
+    
+    return {
+        'reorder_point': reorder_point,
+        'order_quantity': order_quantity,
+        'safety_stock': np.maximum(reorder_point - mean * lead_time_days, 0.0),
+        'expected_service_level': expected_service,
+        'refined': refined
+    }
+
+
 class VisionEngine:
     """
     High-precision computer vision for product identification
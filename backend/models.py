@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean, UniqueConstraint, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -68,6 +68,7 @@ class Inventory(Base):
     current_stock = Column(Integer, default=0)
     reserved_stock = Column(Integer, default=0)  # Allocated but not shipped
     available_stock = Column(Integer, default=0)  # current - reserved
+    safety_stock = Column(Integer, nullable=True)  # Recomputed per location; falls back to Product.safety_stock_level
     last_updated = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
@@ -117,6 +118,8 @@ class ReplenishmentRecommendation(Base):
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     location_id = Column(Integer, ForeignKey("locations.id"), nullable=True)
     recommendation_date = Column(DateTime, default=datetime.utcnow)
+    recommendation_type = Column(String, default="purchase", server_default="purchase")  # purchase, transfer
+    source_location_id = Column(Integer, ForeignKey("locations.id"), nullable=True)  # Transfer origin
     reorder_quantity = Column(Integer, nullable=False)
     reorder_point = Column(Integer)  # When to reorder
     current_stock_level = Column(Integer)
@@ -128,6 +131,36 @@ class ReplenishmentRecommendation(Base):
     notes = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class RecommendationDirtyPair(Base):
+    """(product, location) pairs whose inputs changed since the last recommendation run"""
+    __tablename__ = "recommendation_dirty_pairs"
+    __table_args__ = (UniqueConstraint("product_id", "location_id", name="uq_recommendation_dirty_pair"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    location_id = Column(Integer, ForeignKey("locations.id"), nullable=False)
+    reason = Column(String)  # initial, inventory, detection, sales, forecast, product, safety_stock, policy
+    marked_at = Column(DateTime, default=datetime.utcnow)
+
+class InventoryPolicy(Base):
+    """Optimized replenishment policy per product-location, read by recommendation generation"""
+    __tablename__ = "inventory_policies"
+    __table_args__ = (UniqueConstraint("product_id", "location_id", name="uq_inventory_policy"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    location_id = Column(Integer, ForeignKey("locations.id"), nullable=False)
+    policy_type = Column(String, default="sS")  # sS (order up to S), RQ (order multiples of Q)
+    reorder_point = Column(Integer, nullable=False)  # s / R
+    order_quantity = Column(Integer, nullable=False)  # Q
+    order_up_to = Column(Integer)  # S
+    safety_stock = Column(Integer)
+    expected_service_level = Column(Float)
+    method = Column(String)  # analytic, simulated
+    demand_mean = Column(Float)
+    demand_std = Column(Float)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
 class SimulationRun(Base):
     __tablename__ = "simulation_runs"
     
@@ -141,6 +174,17 @@ class SimulationRun(Base):
     created_by = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class SimulationTrajectory(Base):
+    """Full daily series of a simulation run, kept out of the JSON results blob"""
+    __tablename__ = "simulation_trajectories"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    simulation_id = Column(Integer, ForeignKey("simulation_runs.id"), unique=True, nullable=False, index=True)
+    days = Column(Integer, nullable=False)
+    series = Column(String)  # Comma-separated array names in the archive
+    data = Column(LargeBinary, nullable=False)  # np.savez_compressed archive
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class Camera(Base):
     __tablename__ = "cameras"
     
@@ -150,6 +194,7 @@ class Camera(Base):
     resolution = Column(String, default="1920x1080")
     fps = Column(Integer, default=30)
     status = Column(String, default="active")  # active, inactive, maintenance
+    roi = Column(Text, nullable=True)  # JSON list of shelf polygons [[[x, y], ...], ...] in 0-1 frame coordinates
     last_active = Column(DateTime, default=datetime.utcnow)
     created_at = Column(DateTime, default=datetime.utcnow)
     
@@ -0,0 +1,109 @@
+from datetime import datetime
+from typing import Dict
+import numpy as np
+from sqlalchemy.orm import Session
+import models
+from database import SessionLocal
+from change_tracking import mark_dirty_pairs
+from ml_engine import PolicyOptimizer
+from recalculate_safety_stock import load_demand_statistics
+
+
+def optimize_policies(
+    db: Session = None,
+    service_level: float = 0.95,
+    policy_type: str = "sS",
+    ordering_cost: float = 50.0,
+    holding_rate: float = 0.25,
+    lookback_days: int = 90,
+    max_workers: int = None
+) -> Dict:
+    """
+    Compute an (s, S) or (R, Q) policy for every product-location with recent sales
+    and upsert it into inventory_policies. Series whose policy changed are marked dirty
+    so the next incremental recommendation run picks them up.
+    """
+    should_close = False
+    if db is None:
+        db = SessionLocal()
+        should_close = True
+
+    try:
+        stats = load_demand_statistics(db, lookback_days)
+        if stats is None:
+            return {"updated": 0, "unchanged": 0, "simulated": 0}
+
+        optimizer = PolicyOptimizer(
+            service_level=service_level,
+            policy_type=policy_type,
+            ordering_cost=ordering_cost,
+            holding_rate=holding_rate,
+            max_workers=max_workers
+        )
+        policies = optimizer.optimize(
+            stats["mean"], stats["sigma"], stats["lead_time_days"], stats["unit_cost"]
+        )
+
+        existing = {
+            (p.product_id, p.location_id): p
+            for p in db.query(models.InventoryPolicy).all()
+        }
+        now = datetime.utcnow()
+        inserts, updates, changed_pairs = [], [], []
+        for i in range(len(stats["inventory_ids"])):
+            key = (int(stats["product_ids"][i]), int(stats["location_ids"][i]))
+            values = {
+                "product_id": key[0],
+                "location_id": key[1],
+                "policy_type": policy_type,
+                "reorder_point": int(policies["reorder_point"][i]),
+                "order_quantity": int(policies["order_quantity"][i]),
+                "order_up_to": int(policies["order_up_to"][i]),
+                "safety_stock": int(np.ceil(policies["safety_stock"][i])),
+                "expected_service_level": round(float(policies["expected_service_level"][i]), 4),
+                "method": "simulated" if policies["refined"][i] else "analytic",
+                "demand_mean": round(float(stats["mean"][i]), 4),
+                "demand_std": round(float(stats["sigma"][i]), 4),
+                "updated_at": now
+            }
+            current = existing.get(key)
+            if current is None:
+                inserts.append(values)
+            elif (current.policy_type, current.reorder_point, current.order_quantity, current.order_up_to) != (
+                values["policy_type"], values["reorder_point"], values["order_quantity"], values["order_up_to"]
+            ):
+                updates.append({**values, "id": current.id})
+            else:
+                continue
+            changed_pairs.append(key)
+
+        if inserts:
+            db.bulk_insert_mappings(models.InventoryPolicy, inserts)
+        if updates:
+            db.bulk_update_mappings(models.InventoryPolicy, updates)
+        if changed_pairs:
+            mark_dirty_pairs(db, changed_pairs, "policy")
+        db.commit()
+
+        total = len(stats["inventory_ids"])
+        simulated = int(np.count_nonzero(policies["refined"]))
+        print(f"✅ Inventory policies optimized: {len(changed_pairs)} updated, {simulated} simulation-refined.")
+        return {
+            "updated": len(changed_pairs),
+            "unchanged": total - len(changed_pairs),
+            "simulated": simulated,
+            "policy_type": policy_type,
+            "service_level": service_level,
+            "window_end": stats["window_end"]
+        }
+
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        if should_close:
+            db.close()
+
+
+if __name__ == "__main__":
+    optimize_policies()
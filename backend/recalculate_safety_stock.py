@@ -0,0 +1,168 @@
+from datetime import timedelta
+from statistics import NormalDist
+from typing import Dict, Optional
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+import models
+from database import SessionLocal
+from change_tracking import mark_dirty_pairs
+
+MIN_ERROR_POINTS = 7  # Forecast/actual overlaps needed before trusting forecast error over demand spread
+
+
+def load_demand_statistics(db: Session, lookback_days: int = 90, include_idle: bool = False) -> Optional[Dict]:
+    """
+    Per product-location daily demand statistics over the lookback window, for every
+    inventory row with sales in it (every inventory row with include_idle, rows without
+    sales counting as zero demand). Returns aligned arrays (None when there are no sales):
+    mean/demand_std of daily demand, forecast_rmse and the error_points behind it, and
+    sigma (forecast RMSE when enough overlap exists, demand spread otherwise).
+    """
+    window_end = db.query(func.max(models.SalesData.date)).scalar()
+    if window_end is None:
+        return None
+    window_start = window_end - timedelta(days=lookback_days)
+
+    # Daily demand per series, then mean/variance inputs and forecast error in one grouped query
+    sale_day = func.date(models.SalesData.date)
+    daily = db.query(
+        models.SalesData.product_id.label("product_id"),
+        models.SalesData.location_id.label("location_id"),
+        sale_day.label("day"),
+        func.sum(models.SalesData.quantity_sold).label("qty")
+    ).filter(
+        models.SalesData.date > window_start
+    ).group_by(
+        models.SalesData.product_id, models.SalesData.location_id, sale_day
+    ).subquery()
+
+    error = daily.c.qty - models.Forecast.predicted_quantity
+    stats = db.query(
+        daily.c.product_id,
+        daily.c.location_id,
+        func.min(daily.c.day).label("first_day"),
+        func.sum(daily.c.qty).label("total"),
+        func.sum(daily.c.qty * daily.c.qty).label("total_sq"),
+        func.count(models.Forecast.id).label("error_points"),
+        func.sum(error * error).label("error_sq")
+    ).outerjoin(
+        models.Forecast,
+        (models.Forecast.product_id == daily.c.product_id)
+        & (models.Forecast.location_id == daily.c.location_id)
+        & (func.date(models.Forecast.forecast_date) == daily.c.day)
+    ).group_by(daily.c.product_id, daily.c.location_id).subquery()
+
+    rows = db.query(
+        models.Inventory.id,
+        models.Inventory.product_id,
+        models.Inventory.location_id,
+        models.Inventory.safety_stock,
+        models.Inventory.last_updated,
+        func.coalesce(models.Product.lead_time_days, 7),
+        func.coalesce(models.Product.unit_cost, 0.0),
+        stats.c.first_day,
+        stats.c.total,
+        stats.c.total_sq,
+        stats.c.error_points,
+        stats.c.error_sq
+    ).join(
+        models.Product, models.Product.id == models.Inventory.product_id
+    ).join(
+        stats,
+        (stats.c.product_id == models.Inventory.product_id)
+        & (stats.c.location_id == models.Inventory.location_id),
+        isouter=include_idle
+    ).all()
+
+    if not rows:
+        return None
+
+    columns = list(zip(*rows))
+    # Days without a sales record count as zero demand
+    first_day = np.array([np.datetime64(str(d)[:10]) if d is not None else np.datetime64(window_end.date()) for d in columns[7]])
+    observed_days = np.maximum((np.datetime64(window_end.date()) - first_day).astype(np.int64) + 1, 1)
+    total = np.nan_to_num(np.array(columns[8], dtype=np.float64))
+    total_sq = np.nan_to_num(np.array(columns[9], dtype=np.float64))
+    error_points = np.nan_to_num(np.array(columns[10], dtype=np.float64))
+    error_sq = np.nan_to_num(np.array(columns[11], dtype=np.float64))
+
+    mean = total / observed_days
+    demand_std = np.sqrt(np.maximum(total_sq / observed_days - mean ** 2, 0.0))
+    forecast_rmse = np.sqrt(error_sq / np.maximum(error_points, 1.0))
+
+    return {
+        "window_end": window_end,
+        "inventory_ids": list(columns[0]),
+        "product_ids": np.array(columns[1], dtype=np.int64),
+        "location_ids": np.array(columns[2], dtype=np.int64),
+        "safety_stock": list(columns[3]),
+        "last_updated": list(columns[4]),
+        "lead_time_days": np.array(columns[5], dtype=np.float64),
+        "unit_cost": np.array(columns[6], dtype=np.float64),
+        "mean": mean,
+        "demand_std": demand_std,
+        "forecast_rmse": forecast_rmse,
+        "error_points": error_points,
+        "sigma": np.where(error_points >= MIN_ERROR_POINTS, forecast_rmse, demand_std)
+    }
+
+
+def recalculate_safety_stock(db: Session = None, service_level: float = 0.95, lookback_days: int = 90) -> Dict:
+    """
+    Recompute Inventory.safety_stock for every product-location:
+    SS = z(service_level) * sigma_daily * sqrt(lead_time_days).
+    sigma_daily is the RMSE of stored forecasts against actual sales where enough
+    overlap exists, otherwise the standard deviation of daily demand. Rows without
+    sales in the window drop to 0 rather than keeping a stale value.
+    """
+    should_close = False
+    if db is None:
+        db = SessionLocal()
+        should_close = True
+
+    try:
+        stats = load_demand_statistics(db, lookback_days, include_idle=True)
+        if stats is None:
+            return {"updated": 0, "unchanged": 0}
+
+        # Vectorized safety stock over the whole catalog
+        z = NormalDist().inv_cdf(service_level)
+        safety_stock = np.ceil(
+            z * stats["sigma"] * np.sqrt(np.maximum(stats["lead_time_days"], 0.0))
+        ).astype(np.int64)
+
+        # Bulk write only the rows that changed; keep last_updated as the stock-change time
+        updates = []
+        changed_pairs = []
+        for i, inv_id in enumerate(stats["inventory_ids"]):
+            value = int(safety_stock[i])
+            if stats["safety_stock"][i] == value:
+                continue
+            updates.append({"id": inv_id, "safety_stock": value, "last_updated": stats["last_updated"][i]})
+            changed_pairs.append((int(stats["product_ids"][i]), int(stats["location_ids"][i])))
+
+        if updates:
+            db.bulk_update_mappings(models.Inventory, updates)
+            mark_dirty_pairs(db, changed_pairs, "safety_stock")
+            db.commit()
+
+        total = len(stats["inventory_ids"])
+        print(f"✅ Safety stock recalculated: {len(updates)} updated, {total - len(updates)} unchanged.")
+        return {
+            "updated": len(updates),
+            "unchanged": total - len(updates),
+            "service_level": service_level,
+            "window_end": stats["window_end"]
+        }
+
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        if should_close:
+            db.close()
+
+
+if __name__ == "__main__":
+    recalculate_safety_stock()
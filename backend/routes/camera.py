@@ -4,6 +4,7 @@ from database import get_db
 from pydantic import BaseModel
 import models
 from datetime import datetime
+from change_tracking import mark_dirty
 import os
 import shutil
 import uuid
@@ -81,6 +82,7 @@ def handle_detection(
             )
             db.add(inventory)
             
+        mark_dirty(db, product.id, request.location_id, "detection")
         db.commit()
         
         return {
@@ -249,6 +251,7 @@ def handle_detection_with_snapshot(
             )
             db.add(inventory)
             
+        mark_dirty(db, product.id, location_id, "detection")
         db.commit()
         db.refresh(footage)
         
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from database import SessionLocal
 import models, schemas
+import json
 from typing import List
 
 router = APIRouter(prefix="/api/cameras", tags=["cameras"])
@@ -37,6 +38,22 @@ def get_camera(camera_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=44, detail="Camera not found")
     return camera
 
+@router.put("/{camera_id}/roi", response_model=schemas.CameraResponse)
+def update_camera_roi(camera_id: int, roi: schemas.CameraROIUpdate, db: Session = Depends(get_db)):
+    """Set the shelf polygons the detection server crops this camera's frames to"""
+    camera = db.query(models.Camera).filter(models.Camera.id == camera_id).first()
+    if camera is None:
+        raise HTTPException(status_code=404, detail="Camera not found")
+    for polygon in roi.polygons:
+        if len(polygon) < 3 or any(len(point) != 2 for point in polygon):
+            raise HTTPException(status_code=400, detail="Each ROI polygon needs at least 3 [x, y] points")
+        if any(not 0 <= v <= 1 for point in polygon for v in point):
+            raise HTTPException(status_code=400, detail="ROI coordinates must be fractions of the frame (0-1)")
+    camera.roi = json.dumps(roi.polygons) if roi.polygons else None
+    db.commit()
+    db.refresh(camera)
+    return camera
+
 @router.delete("/{camera_id}")
 def delete_camera(camera_id: int, db: Session = Depends(get_db)):
     camera = db.query(models.Camera).filter(models.Camera.id == camera_id).first()
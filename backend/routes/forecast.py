@@ -5,6 +5,7 @@ from database import get_db
 from auth import get_current_user, require_role
 import models
 import schemas
+from change_tracking import mark_dirty
 import pandas as pd
 from ml_engine import ForecastingEngine
 
@@ -71,6 +72,7 @@ def generate_forecast(
             db.add(db_forecast)
             forecasts.append(db_forecast)
             
+        mark_dirty(db, request.product_id, request.location_id, "forecast")
         db.commit()
         for f in forecasts:
             db.refresh(f)
@@ -1,10 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
+from sqlalchemy import func
 from typing import List
 from database import get_db
 from auth import get_current_user, require_role
 import models
 import schemas
+from change_tracking import mark_dirty
+from recalculate_safety_stock import recalculate_safety_stock
 
 router = APIRouter(prefix="/api/inventory", tags=["Inventory"])
 
@@ -64,6 +67,7 @@ def create_inventory(
         available_stock=available
     )
     db.add(db_inventory)
+    mark_dirty(db, inventory.product_id, inventory.location_id, "inventory")
     db.commit()
     db.refresh(db_inventory)
     return db_inventory
@@ -88,6 +92,7 @@ def update_inventory(
     
     # Recalculate available stock
     db_inventory.available_stock = db_inventory.current_stock - db_inventory.reserved_stock
+    mark_dirty(db, db_inventory.product_id, db_inventory.location_id, "inventory")
     
     db.commit()
     db.refresh(db_inventory)
@@ -132,8 +137,25 @@ def get_low_stock_items(
     if threshold:
         query = query.filter(models.Inventory.current_stock <= threshold)
     else:
-        # Use product's safety stock level as threshold
-        query = query.filter(models.Inventory.current_stock <= models.Product.safety_stock_level)
+        # Use the recomputed per-location safety stock, falling back to the product's level
+        query = query.filter(
+            models.Inventory.current_stock <= func.coalesce(models.Inventory.safety_stock, models.Product.safety_stock_level)
+        )
     
     low_stock = query.all()
     return low_stock
+
+@router.post("/safety-stock/recalculate")
+def recalculate_safety_stock_levels(
+    service_level: float = 0.95,
+    lookback_days: int = 90,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_role("manager"))
+):
+    """Recompute per-location safety stock from demand/forecast-error variability (requires manager role)"""
+    if not 0.5 <= service_level < 1.0:
+        raise HTTPException(status_code=400, detail="service_level must be between 0.5 and 1.0")
+    if lookback_days <= 0:
+        raise HTTPException(status_code=400, detail="lookback_days must be positive")
+    
+    return recalculate_safety_stock(db, service_level=service_level, lookback_days=lookback_days)
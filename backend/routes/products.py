@@ -5,6 +5,7 @@ from database import get_db
 from auth import get_current_user, require_role
 import models
 import schemas
+from change_tracking import mark_dirty
 
 router = APIRouter(prefix="/api/products", tags=["Products"])
 
@@ -64,6 +65,8 @@ def create_product(
             reserved_stock=0
         )
         db.add(inventory)
+    db.flush()
+    mark_dirty(db, db_product.id, None, "product")
     db.commit()
     
     return db_product
@@ -82,6 +85,7 @@ def update_product(
     
     for key, value in product.model_dump().items():
         setattr(db_product, key, value)
+    mark_dirty(db, db_product.id, None, "product")
     
     db.commit()
     db.refresh(db_product)
@@ -1,93 +1,459 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from sqlalchemy import func, case, delete, bindparam
+from typing import Dict, List, Optional, Tuple
+from datetime import date, datetime, time
+import numpy as np
 from database import get_db
 from auth import get_current_user, require_role
+from ml_engine import ReplenishmentCalculator, RebalancingOptimizer
+from optimize_policies import optimize_policies
 import models
 import schemas
 
 router = APIRouter(prefix="/api/recommendations", tags=["Recommendations"])
+calculator = ReplenishmentCalculator()
+
+DEFAULT_LEAD_TIME_DAYS = 7
+
+
+def _lead_time_demand_subquery(db: Session, product_id: Optional[int], location_id: Optional[int], dirty_only: bool):
+    """
+    Aggregate every (product, location) forecast series in one grouped query:
+    total horizon demand, plus the demand sum and variance over the first
+    lead_time_days points of the horizon. Only forecasts from today onwards count.
+    """
+    ranked = db.query(
+        models.Forecast.product_id.label("product_id"),
+        models.Forecast.location_id.label("location_id"),
+        models.Forecast.predicted_quantity.label("predicted_quantity"),
+        # ForecastingEngine builds intervals as prediction +/- 1.96 sigma; the upper side is never clipped
+        ((func.coalesce(models.Forecast.upper_bound, models.Forecast.predicted_quantity)
+          - models.Forecast.predicted_quantity) / 1.96).label("sigma"),
+        func.row_number().over(
+            partition_by=(models.Forecast.product_id, models.Forecast.location_id),
+            order_by=(models.Forecast.forecast_date.asc(), models.Forecast.id.asc())
+        ).label("rn")
+    ).filter(
+        # Stale forecasts that were never regenerated must not fill the lead-time window
+        models.Forecast.forecast_date >= datetime.combine(date.today(), time.min)
+    )
+    if dirty_only:
+        ranked = ranked.join(
+            models.RecommendationDirtyPair,
+            (models.RecommendationDirtyPair.product_id == models.Forecast.product_id)
+            & (models.RecommendationDirtyPair.location_id == models.Forecast.location_id)
+        )
+    if product_id:
+        ranked = ranked.filter(models.Forecast.product_id == product_id)
+    if location_id:
+        ranked = ranked.filter(models.Forecast.location_id == location_id)
+    ranked = ranked.subquery()
+
+    in_lead_time = ranked.c.rn <= func.coalesce(models.Product.lead_time_days, DEFAULT_LEAD_TIME_DAYS)
+    return db.query(
+        ranked.c.product_id,
+        ranked.c.location_id,
+        func.count().label("horizon_days"),
+        func.sum(ranked.c.predicted_quantity).label("horizon_demand"),
+        func.sum(case((in_lead_time, 1), else_=0)).label("lead_time_points"),
+        func.sum(case((in_lead_time, ranked.c.predicted_quantity), else_=0.0)).label("lead_time_demand"),
+        func.sum(case((in_lead_time, ranked.c.sigma * ranked.c.sigma), else_=0.0)).label("lead_time_variance")
+    ).join(
+        models.Product, models.Product.id == ranked.c.product_id
+    ).group_by(ranked.c.product_id, ranked.c.location_id).subquery()
+
+
+def _evaluate_inventory(db: Session, product_id: Optional[int], location_id: Optional[int], dirty_only: bool) -> Dict:
+    """
+    One joined pass over inventory + product settings + aggregated forecast demand,
+    followed by the vectorized reorder math for the whole batch.
+    """
+    demand = _lead_time_demand_subquery(db, product_id, location_id, dirty_only)
+    query = db.query(
+        models.Inventory.product_id,
+        models.Inventory.location_id,
+        func.coalesce(models.Inventory.current_stock, 0),
+        func.coalesce(models.Inventory.safety_stock, models.Product.safety_stock_level, 0),
+        func.coalesce(models.Product.lead_time_days, DEFAULT_LEAD_TIME_DAYS),
+        func.coalesce(models.Product.unit_cost, 0.0),
+        models.Location.type,
+        demand.c.horizon_days,
+        demand.c.horizon_demand,
+        demand.c.lead_time_points,
+        demand.c.lead_time_demand,
+        demand.c.lead_time_variance,
+        models.InventoryPolicy.policy_type,
+        models.InventoryPolicy.reorder_point,
+        models.InventoryPolicy.order_quantity,
+        models.InventoryPolicy.order_up_to,
+        models.InventoryPolicy.safety_stock
+    ).join(
+        models.Product, models.Product.id == models.Inventory.product_id
+    ).join(
+        models.Location, models.Location.id == models.Inventory.location_id
+    ).outerjoin(
+        demand,
+        (demand.c.product_id == models.Inventory.product_id)
+        & (demand.c.location_id == models.Inventory.location_id)
+    ).outerjoin(
+        models.InventoryPolicy,
+        (models.InventoryPolicy.product_id == models.Inventory.product_id)
+        & (models.InventoryPolicy.location_id == models.Inventory.location_id)
+    )
+    if dirty_only:
+        query = query.join(
+            models.RecommendationDirtyPair,
+            (models.RecommendationDirtyPair.product_id == models.Inventory.product_id)
+            & (models.RecommendationDirtyPair.location_id == models.Inventory.location_id)
+        )
+    if product_id:
+        query = query.filter(models.Inventory.product_id == product_id)
+    if location_id:
+        query = query.filter(models.Inventory.location_id == location_id)
+
+    rows = query.all()
+    columns = list(zip(*rows)) if rows else [()] * 17
+    current_stock = np.array(columns[2], dtype=np.float64)
+    safety_stock = np.array(columns[3], dtype=np.float64)
+    lead_time_days = np.array(columns[4], dtype=np.float64)
+    horizon_days = np.array(columns[7], dtype=np.float64)  # None -> nan for series without forecasts
+    horizon_demand = np.array(columns[8], dtype=np.float64)
+    lead_time_points = np.array(columns[9], dtype=np.float64)
+    lead_time_demand = np.array(columns[10], dtype=np.float64)
+    lead_time_variance = np.array(columns[11], dtype=np.float64)
+
+    has_forecast = np.nan_to_num(horizon_days) > 0
+    # Horizon shorter than the lead time: extrapolate the covered days at the same daily rate
+    coverage = np.where(lead_time_points > 0, lead_time_days / np.where(lead_time_points > 0, lead_time_points, 1.0), 1.0)
+    lead_time_demand = np.where(has_forecast, lead_time_demand * coverage, safety_stock * 0.5)
+    lead_time_variance = np.where(has_forecast, lead_time_variance * coverage, 0.0)
+    forecasted_demand = np.where(has_forecast, horizon_demand, safety_stock * 0.5)
+
+    calc = calculator.calculate_reorder_quantities(
+        forecasted_demand=forecasted_demand,
+        lead_time_demand=lead_time_demand,
+        lead_time_variance=lead_time_variance,
+        current_stock=current_stock,
+        safety_stock=safety_stock
+    )
+    # Stored (s, S) / (R, Q) policies from the policy optimizer take precedence
+    policy_type = np.array(columns[12], dtype=object)
+    calc = calculator.apply_inventory_policies(
+        calc,
+        current_stock=current_stock,
+        has_policy=np.array([t is not None for t in policy_type], dtype=bool),
+        policy_type=policy_type,
+        reorder_point=np.array(columns[13], dtype=np.float64),
+        order_quantity=np.array(columns[14], dtype=np.float64),
+        order_up_to=np.array(columns[15], dtype=np.float64),
+        policy_safety_stock=np.array(columns[16], dtype=np.float64)
+    )
+    return {
+        **calc,
+        "product_ids": np.array(columns[0], dtype=np.int64),
+        "location_ids": np.array(columns[1], dtype=np.int64),
+        "unit_cost": np.array(columns[5], dtype=np.float64),
+        "location_types": np.array(columns[6], dtype=object),
+        "current_stock": current_stock,
+        "forecasted_demand": forecasted_demand,
+        "has_forecast": has_forecast,
+        "needs_reorder": calc["reorder_quantity"] > 0
+    }
+
+
+def _purchase_values(batch: Dict, i: int, quantity: int) -> Dict:
+    """Recommendation column values for a purchase order on batch row i"""
+    return {
+        "product_id": int(batch["product_ids"][i]),
+        "location_id": int(batch["location_ids"][i]),
+        "recommendation_type": "purchase",
+        "source_location_id": None,
+        "reorder_quantity": int(quantity),
+        "reorder_point": int(batch["reorder_point"][i]),
+        "current_stock_level": int(batch["current_stock"][i]),
+        "forecasted_demand": float(batch["forecasted_demand"][i]),
+        "lead_time_demand": float(batch["lead_time_demand"][i]),
+        "safety_stock": int(batch["safety_stock"][i]),
+        "priority": str(batch["priority"][i])
+    }
+
+
+def _pending_key(product_id, location_id, recommendation_type, source_location_id):
+    return (product_id, location_id, recommendation_type or "purchase", source_location_id)
+
+
+def _load_pending(db: Session, product_id: Optional[int], location_id: Optional[int]) -> Dict:
+    """Existing pending recommendations for the scope, keyed by product/location/type/source"""
+    query = db.query(
+        models.ReplenishmentRecommendation.id,
+        models.ReplenishmentRecommendation.product_id,
+        models.ReplenishmentRecommendation.location_id,
+        models.ReplenishmentRecommendation.recommendation_type,
+        models.ReplenishmentRecommendation.source_location_id
+    ).filter(models.ReplenishmentRecommendation.status == "pending")
+    if product_id:
+        query = query.filter(models.ReplenishmentRecommendation.product_id == product_id)
+    if location_id:
+        query = query.filter(models.ReplenishmentRecommendation.location_id == location_id)
+
+    existing = {}
+    for rec_id, *key in query.order_by(models.ReplenishmentRecommendation.id).all():
+        existing.setdefault(_pending_key(*key), rec_id)
+    return existing
+
+
+def _pending_inbound_transfers(db: Session, product_id: Optional[int], location_id: Optional[int]) -> Dict:
+    """Units already on their way to each (product, location) through pending transfer recommendations"""
+    query = db.query(
+        models.ReplenishmentRecommendation.product_id,
+        models.ReplenishmentRecommendation.location_id,
+        func.sum(models.ReplenishmentRecommendation.reorder_quantity)
+    ).filter(
+        models.ReplenishmentRecommendation.status == "pending",
+        models.ReplenishmentRecommendation.recommendation_type == "transfer"
+    )
+    if product_id:
+        query = query.filter(models.ReplenishmentRecommendation.product_id == product_id)
+    if location_id:
+        query = query.filter(models.ReplenishmentRecommendation.location_id == location_id)
+    rows = query.group_by(
+        models.ReplenishmentRecommendation.product_id, models.ReplenishmentRecommendation.location_id
+    ).all()
+    return {(p, l): float(q or 0) for p, l, q in rows}
+
+
+def _upsert_pending(db: Session, existing: Dict, entries: List[Tuple[Dict, str, str]]) -> Tuple[set, set]:
+    """
+    Bulk insert/update pending recommendations.
+    entries are (values, notes_if_new, notes_if_updated); returns the updated ids
+    and the keys of newly inserted rows so callers can read them back.
+    """
+    inserts = []
+    updates = []
+    for values, new_notes, update_notes in entries:
+        key = _pending_key(values["product_id"], values["location_id"],
+                           values["recommendation_type"], values["source_location_id"])
+        if key in existing:
+            updates.append({**values, "id": existing[key], "notes": update_notes})
+        else:
+            inserts.append({**values, "status": "pending", "notes": new_notes})
+
+    if inserts:
+        db.bulk_insert_mappings(models.ReplenishmentRecommendation, inserts)
+    if updates:
+        db.bulk_update_mappings(models.ReplenishmentRecommendation, updates)
+
+    updated_ids = {u["id"] for u in updates}
+    inserted_keys = {
+        _pending_key(r["product_id"], r["location_id"], r["recommendation_type"], r["source_location_id"])
+        for r in inserts
+    }
+    return updated_ids, inserted_keys
+
+
+def _read_back(db: Session, product_id: Optional[int], location_id: Optional[int], updated_ids: set, inserted_keys: set):
+    """Fetch everything an upsert touched in a single query"""
+    query = db.query(models.ReplenishmentRecommendation).filter(
+        models.ReplenishmentRecommendation.status == "pending"
+    )
+    if product_id:
+        query = query.filter(models.ReplenishmentRecommendation.product_id == product_id)
+    if location_id:
+        query = query.filter(models.ReplenishmentRecommendation.location_id == location_id)
+
+    return [
+        rec for rec in query.order_by(models.ReplenishmentRecommendation.id).all()
+        if rec.id in updated_ids or _pending_key(
+            rec.product_id, rec.location_id, rec.recommendation_type, rec.source_location_id
+        ) in inserted_keys
+    ]
+
 
 @router.post("/generate", response_model=List[schemas.RecommendationResponse])
 def generate_recommendations(
     product_id: Optional[int] = None,
     location_id: Optional[int] = None,
+    full: bool = False,
     db: Session = Depends(get_db),
     current_user: dict = Depends(require_role("manager"))
 ):
     """
-    Generate replenishment recommendations using forecast data and current inventory levels
+    Generate replenishment recommendations from forecast demand over each
+    product's lead time and current inventory levels.
+    Only pairs marked dirty since the last run are re-evaluated unless full=true.
     """
-    from datetime import datetime
-    
-    # 1. Get inventory items to analyze
-    query = db.query(models.Inventory)
+    # 0. Snapshot the dirty marks this run consumes
+    dirty_query = db.query(models.RecommendationDirtyPair.id, models.RecommendationDirtyPair.marked_at)
     if product_id:
-        query = query.filter(models.Inventory.product_id == product_id)
+        dirty_query = dirty_query.filter(models.RecommendationDirtyPair.product_id == product_id)
     if location_id:
-        query = query.filter(models.Inventory.location_id == location_id)
-        
-    inventory_items = query.all()
-    recommendations = []
-    
-    for inv in inventory_items:
-        # 2. Get latest product info for safety stock
-        product = db.query(models.Product).filter(models.Product.id == inv.product_id).first()
-        if not product:
-            continue
-            
-        # 3. Get latest forecast
-        latest_forecast = db.query(models.Forecast)\
-            .filter(models.Forecast.product_id == inv.product_id)\
-            .filter(models.Forecast.location_id == inv.location_id)\
-            .order_by(models.Forecast.forecast_date.desc())\
-            .first()
-            
-        # 4. Calculate reorder quantity
-        predicted_demand = latest_forecast.predicted_quantity if latest_forecast else (product.safety_stock_level * 0.5)
-        # Goal: Cover demand + safety stock
-        target_stock = predicted_demand + product.safety_stock_level
-        reorder_qty = max(0, target_stock - inv.current_stock)
-        
-        if reorder_qty > 0:
-            # Determine priority
-            stock_ratio = inv.current_stock / (product.safety_stock_level or 1)
-            priority = "urgent" if stock_ratio < 0.5 else "high" if stock_ratio < 1.0 else "medium"
-            
-            # 5. Check for existing pending recommendation
-            existing = db.query(models.ReplenishmentRecommendation).filter(
-                models.ReplenishmentRecommendation.product_id == inv.product_id,
-                models.ReplenishmentRecommendation.location_id == inv.location_id,
-                models.ReplenishmentRecommendation.status == "pending"
-            ).first()
-            
-            if not existing:
-                recommendation = models.ReplenishmentRecommendation(
-                    product_id=inv.product_id,
-                    location_id=inv.location_id,
-                    reorder_quantity=int(reorder_qty),
-                    reorder_point=product.safety_stock_level,
-                    current_stock_level=inv.current_stock,
-                    safety_stock=product.safety_stock_level,
-                    priority=priority,
-                    status="pending",
-                    notes=f"Generated using {'ML Forecast' if latest_forecast else 'Safety Stock fallback'}"
-                )
-                db.add(recommendation)
-                recommendations.append(recommendation)
-            else:
-                # Update existing
-                existing.reorder_quantity = int(reorder_qty)
-                existing.priority = priority
-                existing.notes = f"Updated using {'ML Forecast' if latest_forecast else 'Safety Stock'}"
-                recommendations.append(existing)
-                
-    if recommendations:
-        db.commit()
-        for rec in recommendations:
-            db.refresh(rec)
-            
-    return recommendations
+        dirty_query = dirty_query.filter(models.RecommendationDirtyPair.location_id == location_id)
+    dirty_marks = dirty_query.all()
+    if not full and not dirty_marks:
+        return []
+
+    # 1-2. Joined inventory/forecast pass and vectorized reorder math
+    batch = _evaluate_inventory(db, product_id, location_id, dirty_only=not full)
+
+    # Stock already covered by a pending inbound transfer (from /rebalance) is not ordered again
+    inbound = _pending_inbound_transfers(db, product_id, location_id)
+    if inbound:
+        in_transit = np.array([
+            inbound.get((int(p), int(l)), 0.0) for p, l in zip(batch["product_ids"], batch["location_ids"])
+        ], dtype=np.float64)
+        batch["reorder_quantity"] = np.maximum(0, batch["reorder_quantity"] - in_transit).astype(batch["reorder_quantity"].dtype)
+        batch["needs_reorder"] = batch["reorder_quantity"] > 0
+
+    # 3-4. Bulk upsert against the pending recommendations fetched once
+    entries = []
+    for i in np.flatnonzero(batch["needs_reorder"]):
+        source = "ML Forecast" if batch["has_forecast"][i] else "Safety Stock"
+        entries.append((
+            _purchase_values(batch, i, batch["reorder_quantity"][i]),
+            f"Generated using {source if batch['has_forecast'][i] else 'Safety Stock fallback'}",
+            f"Updated using {source}"
+        ))
+    updated_ids, inserted_keys = _upsert_pending(db, _load_pending(db, product_id, location_id), entries)
+
+    # 5. Clear consumed marks in the same transaction; a pair re-marked meanwhile
+    # carries a newer marked_at and survives for the next run
+    if dirty_marks:
+        dirty_table = models.RecommendationDirtyPair.__table__
+        db.execute(
+            delete(dirty_table).where(
+                (dirty_table.c.id == bindparam("mark_id"))
+                & (dirty_table.c.marked_at == bindparam("mark_time"))
+            ),
+            [{"mark_id": mark_id, "mark_time": marked_at} for mark_id, marked_at in dirty_marks]
+        )
+    db.commit()
+
+    if not entries:
+        return []
+
+    # 6. Read back everything touched in a single query
+    return _read_back(db, product_id, location_id, updated_ids, inserted_keys)
+
+
+@router.post("/rebalance", response_model=List[schemas.RecommendationResponse])
+def rebalance_inventory(
+    product_id: Optional[int] = None,
+    transfer_cost_ratio: float = 0.1,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_role("manager"))
+):
+    """
+    Cover shortfalls across locations: move surplus stock between locations
+    where that is cheaper than buying, and purchase the remainder.
+    transfer_cost_ratio is the per-unit transfer cost as a fraction of unit cost.
+    """
+    if transfer_cost_ratio < 0:
+        raise HTTPException(status_code=400, detail="transfer_cost_ratio must be non-negative")
+
+    # 1. Evaluate every location of the products in scope
+    batch = _evaluate_inventory(db, product_id, None, dirty_only=False)
+    if batch["product_ids"].size == 0:
+        return []
+
+    # 2. Shortfalls below the reorder point vs. stock above a location's own order-up-to level
+    order_up_to = batch["forecasted_demand"] + batch["safety_stock"]
+    requirement = np.where(batch["needs_reorder"], batch["reorder_quantity"], 0)
+    available = np.where(batch["needs_reorder"], 0.0, np.maximum(0.0, batch["current_stock"] - order_up_to))
+
+    plan = RebalancingOptimizer(transfer_cost_ratio=transfer_cost_ratio).solve(
+        product_ids=batch["product_ids"],
+        location_ids=batch["location_ids"],
+        location_types=batch["location_types"],
+        requirement=requirement,
+        available=available,
+        unit_cost=batch["unit_cost"]
+    )
+
+    # 3. Transfers and residual purchase orders as pending recommendations
+    entries = []
+    for t in plan["transfers"]:
+        values = _purchase_values(batch, t["to_row"], t["quantity"])
+        values.update({"recommendation_type": "transfer", "source_location_id": t["from_location_id"]})
+        note = f"Transfer {t['quantity']} units from location {t['from_location_id']}"
+        entries.append((values, note, note))
+    for p in plan["purchases"]:
+        entries.append((
+            _purchase_values(batch, p["row"], p["quantity"]),
+            "Generated by rebalancing (residual purchase)",
+            "Updated by rebalancing (residual purchase)"
+        ))
+
+    existing = _load_pending(db, product_id, None)
+    updated_ids, inserted_keys = _upsert_pending(db, existing, entries)
+
+    # 4. Purchase orders fully replaced by transfers are cancelled
+    purchased_rows = {p["row"] for p in plan["purchases"]}
+    covered = []
+    for row in {t["to_row"] for t in plan["transfers"]} - purchased_rows:
+        key = _pending_key(int(batch["product_ids"][row]), int(batch["location_ids"][row]), "purchase", None)
+        if key in existing:
+            covered.append({"id": existing[key], "status": "cancelled", "notes": "Covered by stock transfer"})
+    if covered:
+        db.bulk_update_mappings(models.ReplenishmentRecommendation, covered)
+    db.commit()
+
+    if not entries:
+        return []
+    return _read_back(db, product_id, None, updated_ids, inserted_keys)
+
+@router.post("/policies/optimize")
+def optimize_inventory_policies(
+    service_level: float = 0.95,
+    policy_type: str = "sS",
+    ordering_cost: float = 50.0,
+    holding_rate: float = 0.25,
+    lookback_days: int = 90,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_role("manager"))
+):
+    """
+    Compute (s, S) or (R, Q) policies for every product-location (requires manager role).
+    service_level is a cycle service level (share of replenishment cycles without a stockout).
+    Order quantities are EOQ with ordering_cost per order (default 50) and an annual holding
+    cost of holding_rate x unit cost (default 0.25); products without a unit cost order
+    30 days of demand instead.
+    """
+    if not 0.5 <= service_level < 1.0:
+        raise HTTPException(status_code=400, detail="service_level must be between 0.5 and 1.0")
+    if policy_type not in ("sS", "RQ"):
+        raise HTTPException(status_code=400, detail="policy_type must be 'sS' or 'RQ'")
+    if ordering_cost < 0 or holding_rate <= 0 or lookback_days <= 0:
+        raise HTTPException(status_code=400, detail="ordering_cost must be >= 0, holding_rate and lookback_days positive")
+
+    return optimize_policies(
+        db,
+        service_level=service_level,
+        policy_type=policy_type,
+        ordering_cost=ordering_cost,
+        holding_rate=holding_rate,
+        lookback_days=lookback_days
+    )
+
+
+@router.get("/policies", response_model=List[schemas.InventoryPolicyResponse])
+def get_inventory_policies(
+    product_id: Optional[int] = None,
+    location_id: Optional[int] = None,
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Get stored inventory policies"""
+    query = db.query(models.InventoryPolicy)
+    if product_id:
+        query = query.filter(models.InventoryPolicy.product_id == product_id)
+    if location_id:
+        query = query.filter(models.InventoryPolicy.location_id == location_id)
+
+    return query.order_by(models.InventoryPolicy.product_id, models.InventoryPolicy.location_id).offset(skip).limit(limit).all()
+
 
 @router.get("/", response_model=List[schemas.RecommendationResponse])
 def get_recommendations(
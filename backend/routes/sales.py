@@ -6,6 +6,7 @@ from database import get_db
 from auth import get_current_user, require_role
 import models
 import schemas
+from change_tracking import mark_dirty, mark_dirty_pairs
 
 router = APIRouter(prefix="/api/sales", tags=["Sales Data"])
 
@@ -38,6 +39,7 @@ def create_sales_record(
     """Create sales record (requires manager role)"""
     db_sales = models.SalesData(**sales.model_dump())
     db.add(db_sales)
+    mark_dirty(db, sales.product_id, sales.location_id, "sales")
     db.commit()
     db.refresh(db_sales)
     return db_sales
@@ -67,6 +69,7 @@ def bulk_upload_sales(
         
         # 2. Process rows
         records_added = 0
+        touched_pairs = set()
         for _, row in df.iterrows():
             # Find product
             product = db.query(models.Product).filter(models.Product.sku == str(row['product_sku'])).first()
@@ -87,8 +90,10 @@ def bulk_upload_sales(
                 revenue=float(row.get('revenue', 0.0))
             )
             db.add(db_sales)
+            touched_pairs.add((product.id, location.id))
             records_added += 1
             
+        mark_dirty_pairs(db, touched_pairs, "sales")
         db.commit()
         return {"message": f"Successfully uploaded {records_added} sales records", "total_processed": len(df)}
         
@@ -1,17 +1,121 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import func
+from collections import OrderedDict
+from typing import Dict, List, Optional
 from database import get_db
 from auth import get_current_user, require_role
 import models
 import schemas
 import pandas as pd
+import numpy as np
+import io
 import json
-from ml_engine import SimulationEngine
+import time
+from ml_engine import SimulationEngine, DemandSampler
 
 router = APIRouter(prefix="/api/simulations", tags=["Simulations"])
 engine = SimulationEngine()
 
+MAX_SWEEP_CANDIDATES = 10000
+SAMPLER_CACHE_SIZE = 256
+
+# product_id -> (sales/forecast fingerprint, fitted DemandSampler), least recently used first
+_sampler_cache: OrderedDict = OrderedDict()
+TRAJECTORY_KEYS = ("daily_results", "stock_percentile_bands")  # Inline series in results saved before trajectories moved out
+
+def encode_trajectory(arrays: Dict[str, np.ndarray]) -> bytes:
+    """Pack named daily series into a compressed .npz archive"""
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+def decode_trajectory(data: bytes) -> Dict[str, np.ndarray]:
+    with np.load(io.BytesIO(data)) as archive:
+        return {name: archive[name] for name in archive.files}
+
+def downsample(arrays: Dict[str, np.ndarray], days: int, max_points: Optional[int]):
+    """Average consecutive days into at most max_points buckets; returns (step, day, series)"""
+    step = 1 if not max_points or days <= max_points else -(-days // max_points)
+    starts = np.arange(0, days, step)
+    counts = np.diff(np.append(starts, days))
+    series = {
+        name: (np.add.reduceat(values.astype(np.float64), starts) / counts).tolist()
+        for name, values in arrays.items()
+    }
+    return step, starts.tolist(), series
+
+def summary_only(simulation: models.SimulationRun) -> schemas.SimulationResponse:
+    """Response with any legacy inline series dropped from the results blob"""
+    response = schemas.SimulationResponse.model_validate(simulation)
+    if response.results and any(key in response.results for key in TRAJECTORY_KEYS):
+        results = json.loads(response.results)
+        for key in TRAJECTORY_KEYS:
+            results.pop(key, None)
+        response.results = json.dumps(results)
+    return response
+
+def bounded_int(params: Dict, key: str, default: int, upper: int) -> int:
+    """Integer simulation parameter in 1..upper; anything else is a 400"""
+    value = params.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= upper:
+        raise HTTPException(status_code=400, detail=f"{key} must be an integer between 1 and {upper}")
+    return value
+
+def load_sales_history(db: Session, product_id: int) -> pd.DataFrame:
+    """Historical daily sales for a product; simulations need at least 10 records"""
+    sales_records = db.query(models.SalesData).filter(
+        models.SalesData.product_id == product_id
+    ).order_by(models.SalesData.date.asc()).all()
+    
+    if len(sales_records) < 10:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Insufficient sales data for simulation. Need at least 10 records, found {len(sales_records)}."
+        )
+        
+    return pd.DataFrame([{
+        'date': s.date,
+        'quantity_sold': s.quantity_sold
+    } for s in sales_records])
+
+def get_demand_sampler(db: Session, product_id: int) -> DemandSampler:
+    """
+    Fitted demand sampler for a product, cached until its sales or forecasts change
+    """
+    fingerprint = (
+        *db.query(func.count(models.SalesData.id), func.max(models.SalesData.date)).filter(
+            models.SalesData.product_id == product_id
+        ).one(),
+        *db.query(func.count(models.Forecast.id), func.max(models.Forecast.created_at)).filter(
+            models.Forecast.product_id == product_id,
+            models.Forecast.location_id.is_(None)  # Only the forecasts the sampler reads
+        ).one()
+    )
+    cached = _sampler_cache.get(product_id)
+    if cached and cached[0] == fingerprint:
+        _sampler_cache.move_to_end(product_id)
+        return cached[1]
+    
+    sales_df = load_sales_history(db, product_id)
+    forecasts = db.query(
+        models.Forecast.forecast_date,
+        models.Forecast.predicted_quantity,
+        models.Forecast.upper_bound
+    ).filter(
+        models.Forecast.product_id == product_id,
+        models.Forecast.location_id.is_(None),  # Product-level forecasts, matching the simulated series
+        models.Forecast.forecast_date > sales_df['date'].max()
+    ).all()
+    forecast_df = pd.DataFrame(forecasts, columns=['forecast_date', 'predicted_quantity', 'upper_bound'])
+    
+    sampler = DemandSampler.fit(sales_df, forecast_df)
+    _sampler_cache[product_id] = (fingerprint, sampler)
+    _sampler_cache.move_to_end(product_id)
+    if len(_sampler_cache) > SAMPLER_CACHE_SIZE:
+        _sampler_cache.popitem(last=False)
+    return sampler
+
 @router.post("/run", response_model=schemas.SimulationResponse)
 def run_simulation(
     simulation: schemas.SimulationCreate,
@@ -31,34 +135,39 @@ def run_simulation(
     if not product_id:
         raise HTTPException(status_code=400, detail="product_id is required in simulation parameters")
         
-    # 2. Fetch sales data for historical context
-    sales_records = db.query(models.SalesData).filter(
-        models.SalesData.product_id == product_id
-    ).order_by(models.SalesData.date.asc()).all()
-    
-    if len(sales_records) < 10:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Insufficient sales data for simulation. Need at least 10 records, found {len(sales_records)}."
-        )
+    mode = params.get("mode", "single")
+    if mode not in ("single", "monte_carlo"):
+        raise HTTPException(status_code=400, detail="mode must be 'single' or 'monte_carlo'")
+    # Same bounds as SimulationSweepRequest; the engine allocates n_scenarios x simulation_days arrays
+    simulation_days = bounded_int(params, "simulation_days", 90, schemas.MAX_SIMULATION_DAYS)
+    n_scenarios = bounded_int(params, "n_scenarios", 1000, schemas.MAX_SCENARIOS) if mode == "monte_carlo" else None
         
-    sales_df = pd.DataFrame([{
-        'date': s.date,
-        'quantity_sold': s.quantity_sold
-    } for s in sales_records])
+    # 2. Demand model fitted to sales history and stored forecasts
+    sampler = get_demand_sampler(db, product_id)
     
-    # 3. Run simulation
+    # 3. Run simulation (single path, or a Monte Carlo batch of scenarios)
+    policy = dict(
+        sales_df=None,
+        sampler=sampler,
+        initial_stock=params.get("initial_stock", 100),
+        reorder_point=params.get("reorder_point", 50),
+        reorder_quantity=params.get("reorder_quantity", 100),
+        lead_time_days=params.get("lead_time_days", 7),
+        simulation_days=simulation_days,
+        lead_time_std=params.get("lead_time_std", 0.0)
+    )
     try:
-        results = engine.run_simulation(
-            sales_df=sales_df,
-            initial_stock=params.get("initial_stock", 100),
-            reorder_point=params.get("reorder_point", 50),
-            reorder_quantity=params.get("reorder_quantity", 100),
-            lead_time_days=params.get("lead_time_days", 7),
-            simulation_days=params.get("simulation_days", 90)
-        )
+        if mode == "monte_carlo":
+            results = engine.run_monte_carlo(
+                **policy,
+                n_scenarios=n_scenarios,
+                seed=params.get("seed")
+            )
+        else:
+            results = engine.run_simulation(**policy, seed=params.get("seed"))
+        trajectory = results.pop("trajectory")
         
-        # 4. Save to database
+        # 4. Save summary to the run, full daily series to its trajectory record
         db_simulation = models.SimulationRun(
             name=simulation.name,
             description=simulation.description,
@@ -70,6 +179,13 @@ def run_simulation(
         )
         
         db.add(db_simulation)
+        db.flush()
+        db.add(models.SimulationTrajectory(
+            simulation_id=db_simulation.id,
+            days=policy["simulation_days"],
+            series=",".join(trajectory),
+            data=encode_trajectory(trajectory)
+        ))
         db.commit()
         db.refresh(db_simulation)
         
@@ -79,6 +195,53 @@ def run_simulation(
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Simulation failed: {str(e)}")
 
+@router.post("/sweep")
+def sweep_reorder_policy(
+    request: schemas.SimulationSweepRequest,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_role("manager"))
+):
+    """
+    Evaluate a grid of reorder_point x reorder_quantity policies on shared demand
+    scenarios and return the cost vs. service-level Pareto frontier
+    """
+    def as_sequence(spec):
+        # Ranges stay lazy so the size check runs before any list is allocated
+        return spec.as_range() if isinstance(spec, schemas.ParameterRange) else spec
+    
+    reorder_points = as_sequence(request.reorder_points)
+    reorder_quantities = as_sequence(request.reorder_quantities)
+    n_candidates = len(reorder_points) * len(reorder_quantities)
+    if n_candidates == 0:
+        raise HTTPException(status_code=400, detail="reorder_points and reorder_quantities must not be empty")
+    if n_candidates > MAX_SWEEP_CANDIDATES:
+        raise HTTPException(status_code=400, detail=f"Sweep too large: {n_candidates} candidates (max {MAX_SWEEP_CANDIDATES})")
+    reorder_points, reorder_quantities = list(reorder_points), list(reorder_quantities)
+    
+    sampler = get_demand_sampler(db, request.product_id)
+    
+    try:
+        started = time.perf_counter()
+        results = engine.run_sweep(
+            sales_df=None,
+            sampler=sampler,
+            initial_stock=request.initial_stock,
+            reorder_points=reorder_points,
+            reorder_quantities=reorder_quantities,
+            lead_time_days=request.lead_time_days,
+            simulation_days=request.simulation_days,
+            n_scenarios=request.n_scenarios,
+            seed=request.seed,
+            lead_time_std=request.lead_time_std,
+            ordering_cost=request.ordering_cost
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Sweep failed: {str(e)}")
+    
+    if not request.include_candidates:
+        results.pop("candidates")
+    return {"product_id": request.product_id, "elapsed_seconds": round(time.perf_counter() - started, 3), **results}
+
 @router.get("/", response_model=List[schemas.SimulationResponse])
 def get_simulations(
     skip: int = 0,
@@ -86,12 +249,12 @@ def get_simulations(
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get all simulations"""
+    """Get all simulations (summary metrics only; see /{id}/trajectory for daily series)"""
     simulations = db.query(models.SimulationRun).order_by(
         models.SimulationRun.created_at.desc()
     ).offset(skip).limit(limit).all()
     
-    return simulations
+    return [summary_only(simulation) for simulation in simulations]
 
 @router.get("/{simulation_id}", response_model=schemas.SimulationResponse)
 def get_simulation(
@@ -109,6 +272,54 @@ def get_simulation(
     
     return simulation
 
+@router.get("/{simulation_id}/trajectory", response_model=schemas.SimulationTrajectoryResponse)
+def get_simulation_trajectory(
+    simulation_id: int,
+    max_points: Optional[int] = None,
+    series: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Full daily series of a simulation, optionally limited to comma-separated
+    series names and averaged down to at most max_points points
+    """
+    if max_points is not None and max_points <= 0:
+        raise HTTPException(status_code=400, detail="max_points must be positive")
+    
+    trajectory = db.query(models.SimulationTrajectory).filter(
+        models.SimulationTrajectory.simulation_id == simulation_id
+    ).first()
+    if trajectory:
+        days = trajectory.days
+        arrays = decode_trajectory(trajectory.data)
+    else:
+        # Runs saved before trajectories moved out keep a truncated series inline
+        simulation = db.query(models.SimulationRun).filter(
+            models.SimulationRun.id == simulation_id
+        ).first()
+        if not simulation:
+            raise HTTPException(status_code=404, detail="Simulation not found")
+        results = json.loads(simulation.results or "{}")
+        if results.get("daily_results"):
+            rows = results["daily_results"]
+            arrays = {name: np.array([row.get(name, 0) for row in rows]) for name in rows[0] if name != "day"}
+        elif results.get("stock_percentile_bands"):
+            arrays = {f"stock_{name}": np.array(band) for name, band in results["stock_percentile_bands"].items()}
+        else:
+            raise HTTPException(status_code=404, detail="No trajectory stored for this simulation")
+        days = len(next(iter(arrays.values())))
+    
+    if series:
+        requested = [name.strip() for name in series.split(",") if name.strip()]
+        unknown = [name for name in requested if name not in arrays]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown series: {', '.join(unknown)}. Available: {', '.join(arrays)}")
+        arrays = {name: arrays[name] for name in requested}
+    
+    step, day, values = downsample(arrays, days, max_points)
+    return {"simulation_id": simulation_id, "days": days, "step": step, "day": day, "series": values}
+
 @router.delete("/{simulation_id}")
 def delete_simulation(
     simulation_id: int,
@@ -123,6 +334,9 @@ def delete_simulation(
     if not simulation:
         raise HTTPException(status_code=404, detail="Simulation not found")
     
+    db.query(models.SimulationTrajectory).filter(
+        models.SimulationTrajectory.simulation_id == simulation_id
+    ).delete()
     db.delete(simulation)
     db.commit()
     
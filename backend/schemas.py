@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, Optional, List, Union
 
 # User Schemas
 class UserBase(BaseModel):
@@ -87,6 +87,7 @@ class InventoryUpdate(BaseModel):
 
 class InventoryResponse(InventoryBase):
     id: int
+    safety_stock: Optional[int] = None
     last_updated: datetime
     
     class Config:
@@ -141,6 +142,8 @@ class AnomalyResponse(AnomalyBase):
 class RecommendationBase(BaseModel):
     product_id: int
     location_id: Optional[int] = None
+    recommendation_type: Optional[str] = "purchase"
+    source_location_id: Optional[int] = None
     reorder_quantity: int
     reorder_point: Optional[int] = None
     current_stock_level: Optional[int] = None
@@ -162,6 +165,24 @@ class RecommendationResponse(RecommendationBase):
     class Config:
         from_attributes = True
 
+class InventoryPolicyResponse(BaseModel):
+    id: int
+    product_id: int
+    location_id: int
+    policy_type: str
+    reorder_point: int
+    order_quantity: int
+    order_up_to: Optional[int] = None
+    safety_stock: Optional[int] = None
+    expected_service_level: Optional[float] = None
+    method: Optional[str] = None
+    demand_mean: Optional[float] = None
+    demand_std: Optional[float] = None
+    updated_at: datetime
+    
+    class Config:
+        from_attributes = True
+
 # Simulation Schemas
 class SimulationCreate(BaseModel):
     name: str
@@ -184,6 +205,37 @@ class SimulationResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class SimulationTrajectoryResponse(BaseModel):
+    simulation_id: int
+    days: int
+    step: int = 1  # Days averaged into each returned point
+    day: List[int]
+    series: Dict[str, List[float]]
+
+MAX_SIMULATION_DAYS = 3650
+MAX_SCENARIOS = 10000
+
+class ParameterRange(BaseModel):
+    start: int
+    stop: int  # Inclusive
+    step: int = Field(1, gt=0)
+    
+    def as_range(self) -> range:
+        return range(self.start, self.stop + 1, self.step)
+
+class SimulationSweepRequest(BaseModel):
+    product_id: int
+    reorder_points: Union[List[int], ParameterRange]
+    reorder_quantities: Union[List[int], ParameterRange]
+    initial_stock: int = 100
+    lead_time_days: int = 7
+    lead_time_std: float = 0.0
+    simulation_days: int = Field(90, gt=0, le=MAX_SIMULATION_DAYS)
+    n_scenarios: int = Field(200, gt=0, le=MAX_SCENARIOS)
+    ordering_cost: float = 0.0  # Fixed cost per order placed
+    seed: Optional[int] = None
+    include_candidates: bool = False
+
 # Forecast Request
 class ForecastRequest(BaseModel):
     product_id: int
@@ -207,8 +259,12 @@ class CameraBase(BaseModel):
 class CameraCreate(CameraBase):
     pass
 
+class CameraROIUpdate(BaseModel):
+    polygons: List[List[List[float]]]  # [[[x, y], ...], ...] in 0-1 frame coordinates; empty clears the ROI
+
 class CameraResponse(CameraBase):
     id: int
+    roi: Optional[str] = None  # JSON string of shelf polygons in 0-1 frame coordinates (set via PUT /roi)
     last_active: datetime
     created_at: datetime
     
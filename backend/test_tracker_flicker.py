@@ -0,0 +1,50 @@
+"""
+Regression check: video tracking must count each shelf item once when detections flicker.
+A static camera sees a row of identical-looking products, each missed on 20% of sampled
+frames; the tracker should end up with exactly one track per product.
+
+Usage: python test_tracker_flicker.py (loads the detection server models on import)
+"""
+import numpy as np
+from yolov8_detection_server import BoxTracker, track_max_age
+
+FLICKER = 0.2
+
+
+def shelf_frames(n_items, n_frames, seed):
+    """Sampled frames of a shelf row; every product drops out independently with probability FLICKER"""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(n_frames):
+        boxes = []
+        for i in range(n_items):
+            x = 60 + 110 * i
+            if rng.random() > FLICKER:
+                jitter = rng.normal(0, 2, 4)
+                boxes.append({
+                    "bbox": [x + jitter[0], 200 + jitter[1], x + 90 + jitter[2], 320 + jitter[3]],
+                    "conf": float(rng.uniform(0.3, 0.9)),
+                    "name": "Fanta"
+                })
+        frames.append(boxes)
+    return frames
+
+
+def count_tracks(frames, sample_seconds):
+    tracker = BoxTracker(max_age=track_max_age(sample_seconds))
+    for boxes in frames:
+        tracker.update(boxes)
+    return len(tracker.results())
+
+
+def test_static_flicker():
+    for sample_seconds in (1.5, 0.5):
+        for seed in range(10):
+            for n_items, n_frames in ((10, 50), (9, 200)):
+                counted = count_tracks(shelf_frames(n_items, n_frames, seed), sample_seconds)
+                assert counted == n_items, f"{counted} tracks for {n_items} items (seed {seed}, every {sample_seconds}s)"
+
+
+if __name__ == "__main__":
+    test_static_flicker()
+    print("✅ Flickering detections: one track per product")
@@ -1,17 +1,29 @@
 import os
+from typing import List, Optional
 import cv2
 import numpy as np
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, Form, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from ultralytics import YOLO
-from PIL import Image
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
+from detector_export import load_detector
 import io
 import torch
 from sqlalchemy.orm import Session
 from database import SessionLocal
 import models
 import json
-from collections import defaultdict
+from collections import defaultdict, Counter, OrderedDict
+from scipy.optimize import linear_sum_assignment
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import threading
+import queue
+import time
+import asyncio
+import shutil
+import tempfile
 
 app = FastAPI()
 
@@ -24,31 +36,135 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ⚙️ Inference backend, chosen at startup: "torch" (eager), "onnx" (ONNX Runtime) or "openvino";
+# YOLO_INT8=1 serves statically quantized exports calibrated on YOLO_CALIBRATION_DIR
+INFERENCE_BACKEND = os.getenv("YOLO_BACKEND", "torch")
+INFERENCE_INT8 = os.getenv("YOLO_INT8", "0") == "1"
+CALIBRATION_DIR = os.getenv("YOLO_CALIBRATION_DIR", os.path.join("static", "footages"))
+
 # Load Models
-print("🚀 Loading YOLOv8 Models (High Precision)...")
-model_custom = YOLO("best_custom.pt") # Specialized Retail Brand Model
-model_nano = YOLO("yolov8n.pt")     # Using Nano for maximum speed and density
+print(f"🚀 Loading YOLOv8 Models (High Precision) on {INFERENCE_BACKEND}{' INT8' if INFERENCE_INT8 else ''}...")
+model_custom = load_detector("best_custom.pt", INFERENCE_BACKEND, INFERENCE_INT8, CALIBRATION_DIR) # Specialized Retail Brand Model
+model_nano = load_detector("yolov8n.pt", INFERENCE_BACKEND, INFERENCE_INT8, CALIBRATION_DIR)     # Using Nano for maximum speed and density
 print("✅ Models Loaded Successfully!")
 
-# Helper: Calculate IoU
-def calculate_iou(box1, box2):
-    x1, y1, x2, y2 = box1
-    x3, y3, x4, y4 = box2
+# Ultralytics predictors keep per-call state and are not thread-safe: calls are serialized per model,
+# so the two models still run concurrently with each other
+MODEL_LOCKS = {id(model_custom): threading.Lock(), id(model_nano): threading.Lock()}
+MODEL_STRIDE = 32  # Letterboxed inputs are padded to a multiple of the models' largest stride
+
+# ⚙️ Inference mode: "parallel" letterboxes each frame once and runs both models concurrently,
+# "sequential" runs them one after the other on the raw frame, "cascade" runs the custom model
+# first and the nano model only where confident brand detections leave the frame uncovered,
+# "tiled" slices each frame into overlapping native-size tiles for dense shelves
+INFERENCE_MODE = os.getenv("YOLO_INFERENCE_MODE", "parallel")
+INFERENCE_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("YOLO_INFERENCE_THREADS", "4")), thread_name_prefix="yolo")
+CASCADE_COVERAGE = float(os.getenv("YOLO_CASCADE_COVERAGE", "0.6"))  # Covered frame fraction that skips the nano pass
+CASCADE_CONF = float(os.getenv("YOLO_CASCADE_CONF", "0.5"))  # Brand confidence that counts towards coverage
+CASCADE_CROP_MAX = 0.75  # Uncovered regions larger than this frame fraction run full-frame
+CASCADE_GRID = 64  # Coverage raster resolution
+TILE_SIZE = int(os.getenv("YOLO_TILE_SIZE", "640"))  # Tiled mode: tiles at the models' native input size
+TILE_OVERLAP = float(os.getenv("YOLO_TILE_OVERLAP", "0.2"))  # Fraction of a tile shared with its neighbour
+TILE_MAX_SIDE = int(os.getenv("YOLO_TILE_MAX_SIDE", "1280"))  # Larger frames are downscaled to this before slicing
+TILE_BATCH = 16  # Tiles per model call
+TILE_EDGE_MARGIN = 2  # Boxes this close to an inner tile edge are cut off; a neighbour tile or the overview has them whole
+TILE_NMS_IOU = 0.5  # Same-class IoU that merges duplicates from overlapping tiles
+VIDEO_BATCH_SIZE = int(os.getenv("YOLO_VIDEO_BATCH", "8"))  # Sampled video frames per model batch
+VIDEO_PREFETCH = 16  # Decoded frames buffered ahead of inference
+VIDEO_WORKERS = int(os.getenv("YOLO_VIDEO_WORKERS", str(min(4, os.cpu_count() or 1))))  # Segment worker processes
+VIDEO_SEGMENT_MIN_SECONDS = float(os.getenv("YOLO_VIDEO_SEGMENT_SECONDS", "60"))  # Shorter videos stay in-process
+BATCH_MAX_SIZE = int(os.getenv("YOLO_BATCH_MAX_SIZE", "8"))  # Realtime frames per cross-request model batch
+BATCH_MAX_WAIT_MS = float(os.getenv("YOLO_BATCH_MAX_WAIT_MS", "5"))  # How long the first frame waits for company
+BULK_MAX_IMAGES = int(os.getenv("YOLO_BULK_MAX_IMAGES", "200"))  # Images accepted per /api/detect/batch request
+MOTION_THRESHOLD = float(os.getenv("YOLO_MOTION_THRESHOLD", "0.02"))  # Changed-pixel fraction that counts as a new scene
+MOTION_PIXEL_DELTA = 25  # Grey-level difference for a thumbnail pixel to count as changed
+MOTION_THUMB_WIDTH = 64  # Reference frames are kept as 64px-wide blurred greyscale thumbnails
+MOTION_MAX_AGE_SECONDS = float(os.getenv("YOLO_MOTION_MAX_AGE", "30"))  # Re-run inference at least this often
+MOTION_MAX_CAMERAS = 256
+ROI_CACHE_SECONDS = 30  # How long a camera's ROI polygons are reused before re-reading cameras.roi
+UPLOAD_CHUNK_BYTES = 1 << 20  # Uploads are spooled to disk 1 MiB at a time
+VIDEO_SAMPLE_SECONDS = float(os.getenv("YOLO_VIDEO_SAMPLE_SECONDS", "1.5"))  # Sampling period for video scans
+VIDEO_MAX_SAMPLES = int(os.getenv("YOLO_VIDEO_MAX_SAMPLES", "50"))  # Long videos widen the period to stay under this
+# 🧭 Video fusion: "track" follows boxes across sampled frames and counts one item per track,
+# "nms" deduplicates every box from every frame by IoU (previous behaviour)
+VIDEO_FUSION = os.getenv("YOLO_VIDEO_FUSION", "track")
+TRACK_MATCH_IOU = float(os.getenv("YOLO_TRACK_MATCH_IOU", "0.2"))  # Minimum IoU between a prediction and its detection
+TRACK_CROSS_LABEL_IOU = 0.75  # A track may switch product name only on a near-identical box
+TRACK_HIGH_CONF = 0.5  # Detections above this are associated first (ByteTrack's two-stage split)
+TRACK_MAX_AGE_SECONDS = float(os.getenv("YOLO_TRACK_MAX_AGE_SECONDS", "10"))  # Video time a track survives without a match
+print(f"⚙️ Inference mode: {INFERENCE_MODE}")
+
+# 📊 Cumulative second-pass counters (reported by /api/detect/stats)
+DETECTION_STATS = defaultdict(int)
+STATS_LOCK = threading.Lock()
+
+# Helper: Pairwise IoU matrix (n x m) for xyxy boxes
+def box_iou(boxes1, boxes2):
+    boxes1 = np.asarray(boxes1, dtype=np.float64).reshape(-1, 4)
+    boxes2 = np.asarray(boxes2, dtype=np.float64).reshape(-1, 4)
+    
+    x_inter1 = np.maximum(boxes1[:, None, 0], boxes2[None, :, 0])
+    y_inter1 = np.maximum(boxes1[:, None, 1], boxes2[None, :, 1])
+    x_inter2 = np.minimum(boxes1[:, None, 2], boxes2[None, :, 2])
+    y_inter2 = np.minimum(boxes1[:, None, 3], boxes2[None, :, 3])
     
-    x_inter1 = max(x1, x3)
-    y_inter1 = max(y1, y3)
-    x_inter2 = min(x2, x4)
-    y_inter2 = min(y2, y4)
+    area_inter = np.maximum(0, x_inter2 - x_inter1) * np.maximum(0, y_inter2 - y_inter1)
+    area_box1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area_box2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    area_union = area_box1[:, None] + area_box2[None, :] - area_inter
     
-    width_inter = max(0, x_inter2 - x_inter1)
-    height_inter = max(0, y_inter2 - y_inter1)
-    area_inter = width_inter * height_inter
+    return np.divide(area_inter, area_union, out=np.zeros_like(area_inter), where=area_union > 0)
+
+NMS_MATRIX_LIMIT = 8192  # Above this many boxes, avoid the n x n suppression matrix
+NMS_BLOCK_ROWS = 512  # Rows per IoU block, bounds temporary memory
+
+def max_iou(boxes, reference):
+    """Highest IoU of each box against any reference box (0 when there are none)"""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if len(boxes) == 0 or len(reference) == 0:
+        return np.zeros(len(boxes))
+    return np.concatenate([
+        box_iou(boxes[start:start + NMS_BLOCK_ROWS], reference).max(axis=1)
+        for start in range(0, len(boxes), NMS_BLOCK_ROWS)
+    ])
+
+def greedy_nms(boxes, order, iou_threshold, labels=None, cross_label_threshold=None):
+    """
+    Greedy NMS over `order`: a box is kept unless an earlier kept box overlaps it by more
+    than the threshold. With labels, same-label pairs use iou_threshold and different-label
+    pairs cross_label_threshold (class-aware). Returns kept indices in pick order.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    order = np.asarray(order, dtype=np.int64)
+    if labels is not None:
+        labels = np.unique(np.asarray(labels, dtype=object), return_inverse=True)[1]  # Integer codes compare fast
     
-    area_box1 = (x2 - x1) * (y2 - y1)
-    area_box2 = (x4 - x3) * (y4 - y3)
-    area_union = area_box1 + area_box2 - area_inter
+    def thresholds(rows, cols):
+        if labels is None:
+            return iou_threshold
+        return np.where(labels[rows][:, None] == labels[cols][None, :], iou_threshold, cross_label_threshold)
     
-    return area_inter / area_union if area_union > 0 else 0
+    keep = []
+    if order.size <= NMS_MATRIX_LIMIT:
+        # Boolean suppression matrix built in row blocks, then one cheap pass in order
+        suppresses = np.zeros((order.size, order.size), dtype=bool)
+        for start in range(0, order.size, NMS_BLOCK_ROWS):
+            rows = order[start:start + NMS_BLOCK_ROWS]
+            suppresses[start:start + rows.size] = box_iou(boxes[rows], boxes[order]) > thresholds(rows, order)
+        suppressed = np.zeros(order.size, dtype=bool)
+        for k in range(order.size):
+            if suppressed[k]:
+                continue
+            keep.append(int(order[k]))
+            suppressed |= suppresses[k]
+        return keep
+    
+    while order.size:
+        i = order[0]
+        keep.append(int(i))
+        rest = order[1:]
+        order = rest[(box_iou(boxes[i], boxes[rest]) <= thresholds(order[:1], rest))[0]]
+    return keep
 
 # Mapping AI labels to Inventory Names
 LABEL_MAPPINGS = {
@@ -83,111 +199,369 @@ HALLUCINATION_BLACKLIST = [
     "toilet", "refrigerator", "dog", "cat", "horse"
 ]
 
-def run_detection_on_frame(image_raw, is_video=False):
-    """Returns RAW detections without database lookups for speed."""
-    image_rgb = cv2.cvtColor(image_raw, cv2.COLOR_BGR2RGB)
-    image = Image.fromarray(image_rgb)
+PRODUCE_CLASSES = ["apple", "orange", "banana", "broccoli", "carrot", "tomato", "potato", "pear", "lemon", "pepper", "cucumber", "sports ball"]
+PACKAGING_CLASSES = ["suitcase", "handbag", "book", "backpack"]
+MARKET_CLASSES = ["bed", "cell phone"]  # "bed" for fresh fish, "cell phone" for price tags
+NOISE_BRANDS = ["amour", "chocapic", "selecto", "wafa", "dziriya"]
+
+def nano_min_conf(class_name):
+    """🛡️ High-Sensitivity Filtering (V12)"""
+    if class_name in HALLUCINATION_BLACKLIST: return np.inf
+    if class_name == "banana": return 0.25 # Stricter for bananas (was 0.35)
+    if class_name in PRODUCE_CLASSES: return 0.10 # Balanced for produce (was 0.18)
+    if class_name in PACKAGING_CLASSES: return 0.05 # Allow these as they are likely packaging
+    return 0.08 # Standard general items
+
+def custom_min_conf(class_name):
+    # 🏎️ Optimized for Video: lowering floor to 0.05 to catch names during playback (V14)
+    return 0.35 if class_name in NOISE_BRANDS else 0.05
+
+def custom_product_name(class_name):
+    # Explicit brand overrides for matching robustness
+    for key, name in [("coca", "Coca Cola"), ("fanta", "Fanta"), ("nestle", "Nestle"), ("nescafe", "Nescafe"), ("ricamar", "Ricamar")]:
+        if key in class_name: return name
+    return class_name.title()
+
+def float32_floor(thresholds, strict):
+    """
+    Smallest float32 confidence passing `conf > t` (strict) or `conf >= t`, so one `>=`
+    on the float32 tensor matches the float64 comparison exactly.
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    floor = thresholds.astype(np.float32)
+    below = floor <= thresholds if strict else floor < thresholds
+    return np.where(below, np.nextafter(floor, np.float32(np.inf)), floor)
+
+def build_class_table(names, min_conf, product_name, strict=False):
+    """Per-class lookup arrays indexed by class id, compiled once per model"""
+    class_names = [names.get(i, "").lower() for i in range(max(names) + 1)]
+    return {
+        "min_conf": float32_floor([min_conf(n) for n in class_names], strict),
+        "name": np.array([product_name(n) for n in class_names], dtype=object),
+        # Produce/market items are deduplicated against each other in priority 2
+        "dedup": np.array([n in PRODUCE_CLASSES or n in MARKET_CLASSES for n in class_names]),
+        "tensors": {}  # min_conf copies per device
+    }
+
+CUSTOM_CLASSES = build_class_table(model_custom.names, custom_min_conf, custom_product_name, strict=True)  # Brands must exceed their floor
+NANO_CLASSES = build_class_table(model_nano.names, nano_min_conf, lambda n: LABEL_MAPPINGS.get(n, n.title()))
+
+def filter_candidates(results, table):
+    """
+    One masked operation per result on boxes.data ([x1, y1, x2, y2, conf, cls]) against the
+    per-class confidence floors; only survivors are copied off the device.
+    Returns one candidate set per result (image).
+    """
+    candidates = []
+    for res in results:
+        data = res.boxes.data
+        if len(data) == 0:
+            candidates.append(empty_candidates())
+            continue
+        min_conf = table["tensors"].get(data.device)
+        if min_conf is None:
+            min_conf = table["tensors"][data.device] = torch.as_tensor(table["min_conf"], device=data.device)
+        data = data[data[:, 4] >= min_conf[data[:, 5].long()]].cpu().numpy()
+        candidates.append({"boxes": data[:, :4].astype(np.float64), "conf": data[:, 4].astype(np.float64), "cls": data[:, 5].astype(np.int64)})
+    return candidates
+
+def empty_candidates():
+    return {"boxes": np.zeros((0, 4)), "conf": np.zeros(0), "cls": np.zeros(0, dtype=np.int64)}
+
+def preprocess_frame(image_raw, size):
+    """
+    Letterbox a BGR frame once into an RGB tensor both models can consume, ultralytics-style:
+    longest side scaled to `size`, then centered 114-gray padding only up to the next multiple
+    of MODEL_STRIDE (a minimal rectangle, not a square). Returns (tensor, ratio, (pad_x, pad_y)).
+    """
+    h, w = image_raw.shape[:2]
+    ratio = min(size / h, size / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    resized = image_raw if (new_w, new_h) == (w, h) else cv2.resize(image_raw, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    dw, dh = (size - new_w) % MODEL_STRIDE, (size - new_h) % MODEL_STRIDE
+    pad_x, pad_y = int(round(dw / 2 - 0.1)), int(round(dh / 2 - 0.1))
+    canvas = np.full((new_h + dh, new_w + dw, 3), 114, dtype=np.uint8)
+    canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = resized
+    tensor = torch.from_numpy(np.ascontiguousarray(canvas[..., ::-1].transpose(2, 0, 1))).float().div_(255).unsqueeze(0)
+    return tensor, ratio, (pad_x, pad_y)
+
+def preprocess_batch(frames, size):
+    """Letterbox frames; returns ([(1, 3, h, w) tensor, ...], [(ratio, pad), ...])"""
+    prepared = [preprocess_frame(frame, size) for frame in frames]
+    return [tensor for tensor, _, _ in prepared], [(ratio, pad) for _, ratio, pad in prepared]
+
+def locked_predict(model, source, **kwargs):
+    with MODEL_LOCKS[id(model)]:
+        return model.predict(source, **kwargs)
+
+def predict_stacked(model, tensors, **kwargs):
+    """Run a model on letterboxed tensors as one batch per distinct shape; results come back in input order"""
+    by_shape = defaultdict(list)
+    for i, tensor in enumerate(tensors):
+        by_shape[tuple(tensor.shape)].append(i)
+    results = [None] * len(tensors)
+    for indices in by_shape.values():
+        for i, result in zip(indices, locked_predict(model, torch.cat([tensors[i] for i in indices]), **kwargs)):
+            results[i] = result
+    return results
+
+def scale_candidates(candidates, ratio, pad, shape):
+    """Map letterboxed box coordinates back onto the original frame, clipped to its bounds"""
+    boxes = candidates["boxes"]
+    boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad[0]) / ratio).clip(0, shape[1])
+    boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad[1]) / ratio).clip(0, shape[0])
+    return candidates
+
+def predict_sequential(frames, inference_sz, custom_conf, nano_conf, frame_stats):
+    results_custom = locked_predict(model_custom, list(frames), conf=custom_conf, iou=0.85, imgsz=inference_sz, verbose=False)
+    results_nano = locked_predict(model_nano, list(frames), conf=nano_conf, iou=0.85, imgsz=inference_sz, verbose=False)
+    return list(zip(filter_candidates(results_custom, CUSTOM_CLASSES), filter_candidates(results_nano, NANO_CLASSES)))
+
+def predict_parallel(frames, inference_sz, custom_conf, nano_conf, frame_stats):
+    """Preprocess once, run the custom model on the pool and nano on this thread; latency ~ the slower model"""
+    tensors, transforms = preprocess_batch(frames, inference_sz)
+    custom_future = INFERENCE_POOL.submit(predict_stacked, model_custom, tensors, conf=custom_conf, iou=0.85, imgsz=inference_sz, verbose=False)
+    results_nano = predict_stacked(model_nano, tensors, conf=nano_conf, iou=0.85, imgsz=inference_sz, verbose=False)
+    results_custom = custom_future.result()
+    return [
+        (scale_candidates(custom, ratio, pad, frame.shape), scale_candidates(nano, ratio, pad, frame.shape))
+        for frame, (ratio, pad), custom, nano in zip(
+            frames, transforms, filter_candidates(results_custom, CUSTOM_CLASSES), filter_candidates(results_nano, NANO_CLASSES)
+        )
+    ]
+
+def coverage_mask(boxes, shape, grid=CASCADE_GRID):
+    """Coarse raster of frame cells lying fully inside any of the boxes"""
+    h, w = shape[:2]
+    mask = np.zeros((grid, grid), dtype=bool)
+    cells = boxes / np.array([w, h, w, h]) * grid
+    for x0, y0, x1, y1 in np.column_stack([np.ceil(cells[:, :2]), np.floor(cells[:, 2:])]).clip(0, grid).astype(int):
+        mask[y0:y1, x0:x1] = True
+    return mask
+
+def uncovered_region(mask, shape, margin=0.05):
+    """Pixel bounding rect (x0, y0, x1, y1) of the uncovered cells, with a small margin"""
+    h, w = shape[:2]
+    grid = mask.shape[0]
+    rows = np.flatnonzero(~mask.all(axis=1))
+    cols = np.flatnonzero(~mask.all(axis=0))
+    x0, x1 = (cols[0] / grid - margin) * w, ((cols[-1] + 1) / grid + margin) * w
+    y0, y1 = (rows[0] / grid - margin) * h, ((rows[-1] + 1) / grid + margin) * h
+    return int(max(x0, 0)), int(max(y0, 0)), int(min(x1, w)), int(min(y1, h))
+
+def predict_nano_region(region, inference_sz, nano_conf, offset):
+    tensor, ratio, pad = preprocess_frame(region, inference_sz)
+    results_nano = locked_predict(model_nano, tensor, conf=nano_conf, iou=0.85, imgsz=inference_sz, verbose=False)
+    nano = scale_candidates(filter_candidates(results_nano, NANO_CLASSES)[0], ratio, pad, region.shape)
+    nano["boxes"] += np.array([offset[0], offset[1], offset[0], offset[1]], dtype=np.float64)
+    return nano
+
+def predict_cascade(frames, inference_sz, custom_conf, nano_conf, frame_stats):
+    """
+    Custom brand model first; the nano model then runs only on the region the confident
+    brand boxes leave uncovered (at the same pixel density), or not at all when coverage
+    reaches CASCADE_COVERAGE. Full-frame second passes share one batch.
+    """
+    tensors, transforms = preprocess_batch(frames, inference_sz)
+    results_custom = predict_stacked(model_custom, tensors, conf=custom_conf, iou=0.85, imgsz=inference_sz, verbose=False)
+    customs = [
+        scale_candidates(custom, ratio, pad, frame.shape)
+        for frame, (ratio, pad), custom in zip(frames, transforms, filter_candidates(results_custom, CUSTOM_CLASSES))
+    ]
     
-    # 🏎️ Optimized for High-Fidelity: 1600 for images, 1280 for video
-    inference_sz = 1024 # Optimized for speed & accuracy (V12)
-    if is_video: inference_sz = 1280
-    elif max(image.size) < 400: inference_sz = 640
+    nanos = [empty_candidates() for _ in frames]
+    full_frames = []
+    for i, (frame, custom, stats) in enumerate(zip(frames, customs, frame_stats)):
+        shape = frame.shape
+        mask = coverage_mask(custom["boxes"][custom["conf"] >= CASCADE_CONF], shape)
+        stats["coverage"] = round(float(mask.mean()), 3)
+        if stats["coverage"] >= CASCADE_COVERAGE:
+            stats["second_pass"] = "skipped"
+            continue
+        x0, y0, x1, y1 = uncovered_region(mask, shape)
+        if (x1 - x0) * (y1 - y0) > CASCADE_CROP_MAX * shape[0] * shape[1]:
+            stats["second_pass"] = "full"
+            full_frames.append(i)
+            continue
+        stats["second_pass"] = "cropped"
+        region = frame[y0:y1, x0:x1]
+        # Keep the full-frame pixel density on the smaller crop
+        region_sz = max(160, int(np.ceil(inference_sz * max(region.shape[:2]) / max(shape[:2]) / 32)) * 32)
+        nanos[i] = predict_nano_region(region, region_sz, nano_conf, (x0, y0))
     
+    if full_frames:
+        results_nano = predict_stacked(model_nano, [tensors[i] for i in full_frames], conf=nano_conf, iou=0.85, imgsz=inference_sz, verbose=False)
+        for i, nano in zip(full_frames, filter_candidates(results_nano, NANO_CLASSES)):
+            ratio, pad = transforms[i]
+            nanos[i] = scale_candidates(nano, ratio, pad, frames[i].shape)
+    return list(zip(customs, nanos))
+
+def tile_origins(length, tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Evenly spread tile starts covering [0, length) with at least `overlap` shared between neighbours"""
+    if length <= tile:
+        return [0]
+    count = int(np.ceil((length - tile) / (tile * (1 - overlap)))) + 1
+    return np.linspace(0, length - tile, count).round().astype(int).tolist()
+
+def frame_tiles(frame):
+    """Returns (scaled frame, scale, [(x0, y0, x1, y1), ...]) tiling the frame at native model size"""
+    h, w = frame.shape[:2]
+    scale = min(1.0, TILE_MAX_SIDE / max(h, w))
+    scaled = frame if scale == 1.0 else cv2.resize(frame, (int(round(w * scale)), int(round(h * scale))), interpolation=cv2.INTER_AREA)
+    h, w = scaled.shape[:2]
+    tiles = [(x, y, min(x + TILE_SIZE, w), min(y + TILE_SIZE, h)) for y in tile_origins(h) for x in tile_origins(w)]
+    return scaled, scale, tiles
+
+def tile_to_frame(candidates, tile, scaled_shape, scale):
+    """Drop boxes cut by an inner tile edge, then map tile coordinates onto the original frame"""
+    x0, y0, x1, y1 = tile
+    h, w = scaled_shape[:2]
+    boxes = candidates["boxes"]
+    m = TILE_EDGE_MARGIN
+    cut = (
+        ((boxes[:, 0] <= m) & (x0 > 0)) | ((boxes[:, 1] <= m) & (y0 > 0)) |
+        ((boxes[:, 2] >= x1 - x0 - m) & (x1 < w)) | ((boxes[:, 3] >= y1 - y0 - m) & (y1 < h))
+    )
+    keep = ~cut
+    return {
+        "boxes": (boxes[keep] + np.array([x0, y0, x0, y0], dtype=np.float64)) / scale,
+        "conf": candidates["conf"][keep],
+        "cls": candidates["cls"][keep]
+    }
+
+def merge_tile_candidates(parts):
+    """Concatenate per-tile candidates and drop same-class duplicates from overlapping tiles"""
+    merged = {
+        "boxes": np.concatenate([p["boxes"] for p in parts]),
+        "conf": np.concatenate([p["conf"] for p in parts]),
+        "cls": np.concatenate([p["cls"] for p in parts])
+    }
+    if len(merged["conf"]) < 2:
+        return merged
+    keep = greedy_nms(merged["boxes"], np.argsort(-merged["conf"], kind="stable"), TILE_NMS_IOU, labels=merged["cls"], cross_label_threshold=np.inf)
+    return {key: value[keep] for key, value in merged.items()}
+
+def predict_tiled(frames, inference_sz, custom_conf, nano_conf, frame_stats):
+    """
+    Sliced inference for dense shelves: every frame becomes overlapping TILE_SIZE tiles (after
+    downscaling to TILE_MAX_SIDE) plus one TILE_SIZE overview for objects larger than a tile.
+    All views of all frames run through both models in shared batches, instead of upscaling the
+    whole frame to inference_sz. Results are merged per frame with class-aware vectorized NMS.
+    """
+    views = []  # (frame index, tensor, (ratio, pad), view shape, tile or None for the overview, scale, scaled frame shape)
+    for i, frame in enumerate(frames):
+        scaled, scale, tiles = frame_tiles(frame)
+        for tile in tiles:
+            crop = scaled[tile[1]:tile[3], tile[0]:tile[2]]
+            tensor, ratio, pad = preprocess_frame(crop, TILE_SIZE)
+            views.append((i, tensor, (ratio, pad), crop.shape, tile, scale, scaled.shape))
+        tensor, ratio, pad = preprocess_frame(frame, TILE_SIZE)
+        views.append((i, tensor, (ratio, pad), frame.shape, None, 1.0, frame.shape))
+        frame_stats[i]["tiles"] = len(tiles)
+    
+    customs = [[] for _ in frames]
+    nanos = [[] for _ in frames]
+    for start in range(0, len(views), TILE_BATCH):
+        chunk = views[start:start + TILE_BATCH]
+        tensors = [view[1] for view in chunk]
+        custom_future = INFERENCE_POOL.submit(predict_stacked, model_custom, tensors, conf=custom_conf, iou=0.85, imgsz=TILE_SIZE, verbose=False)
+        results_nano = predict_stacked(model_nano, tensors, conf=nano_conf, iou=0.85, imgsz=TILE_SIZE, verbose=False)
+        results_custom = custom_future.result()
+        for (i, _, (ratio, pad), shape, tile, scale, scaled_shape), custom, nano in zip(
+            chunk, filter_candidates(results_custom, CUSTOM_CLASSES), filter_candidates(results_nano, NANO_CLASSES)
+        ):
+            for parts, candidates in ((customs[i], custom), (nanos[i], nano)):
+                candidates = scale_candidates(candidates, ratio, pad, shape)
+                parts.append(candidates if tile is None else tile_to_frame(candidates, tile, scaled_shape, scale))
+    return [(merge_tile_candidates(custom), merge_tile_candidates(nano)) for custom, nano in zip(customs, nanos)]
+
+PREDICTORS = {"sequential": predict_sequential, "parallel": predict_parallel, "cascade": predict_cascade, "tiled": predict_tiled}
+
+def inference_size(image_raw, is_video=False):
+    # 🏎️ Optimized for High-Fidelity: 1600 for images, 1280 for video
+    if is_video: return 1280
+    if max(image_raw.shape[:2]) < 400: return 640
+    return 1024 # Optimized for speed & accuracy (V12)
+
+def run_detection_on_frames(frames, is_video=False, stats=None):
+    """
+    Batched detection: frames sharing an inference size go through each model as one batch.
+    Returns one list of RAW detections per frame. If `stats` (one dict per frame) is given,
+    each receives per-frame inference info (second_pass, coverage).
+    """
     # High sensitivity for maximum product counts
     custom_conf = 0.01 # Even more aggressive
     nano_conf = 0.002  # Extreme sensitivity for dense shelves
     
-    results_custom = model_custom.predict(image_raw, conf=custom_conf, iou=0.85, imgsz=inference_sz, verbose=False)
-    results_nano = model_nano.predict(image_raw, conf=nano_conf, iou=0.85, imgsz=inference_sz, verbose=False)
-    
-    custom_candidates = []
-    nano_candidates = []
-    
-    for res in results_custom:
-        for b in res.boxes:
-            bbox = b.xyxy[0].tolist()
-            conf = float(b.conf[0])
-            class_id = int(b.cls[0])
-            class_name = model_custom.names[class_id].lower()
-            custom_candidates.append({"bbox": bbox, "conf": conf, "class_name": class_name, "type": "custom"})
-
-    for res in results_nano:
-        for b in res.boxes:
-            bbox = b.xyxy[0].tolist()
-            conf = float(b.conf[0])
-            class_id = int(b.cls[0])
-            class_name = model_nano.names[class_id].lower()
-            
-            if class_name in HALLUCINATION_BLACKLIST: continue
-            
-            is_produce = class_name in ["apple", "orange", "banana", "broccoli", "carrot", "tomato", "potato", "pear", "lemon", "pepper", "cucumber", "sports ball"]
-            
-            # 🛡️ High-Sensitivity Filtering (V12)
-            min_conf = 0.002 # Base sensitivity
-            
-            if is_produce:
-                min_conf = 0.10 # Balanced for produce (was 0.18)
-                if class_name == "banana":
-                    min_conf = 0.25 # Stricter for bananas (was 0.35)
-            elif class_name in ["suitcase", "handbag", "book", "backpack"]:
-                min_conf = 0.05 # Allow these as they are likely packaging
-            else:
-                min_conf = 0.08 # Standard general items
-                
-            if conf < min_conf: continue
-            
-            nano_candidates.append({"bbox": bbox, "conf": conf, "class_name": class_name, "type": "nano", "is_produce": is_produce})
-
-    final_boxes = []
-    
-    # 🛡️ PRIORITY 1: Custom Retail Brands
-    for cc in custom_candidates:
-        noise_brands = ["amour", "chocapic", "selecto", "wafa", "dziriya"]
-        # 🏎️ Optimized for Video: lowering floor to 0.05 to catch names during playback (V14)
-        min_brand_conf = 0.35 if cc["class_name"] in noise_brands else 0.05 
-        if cc["conf"] > min_brand_conf:
-            product_name = cc["class_name"].title()
-            # Explicit brand overrides for matching robustness
-            if "coca" in cc["class_name"].lower(): product_name = "Coca Cola"
-            elif "fanta" in cc["class_name"].lower(): product_name = "Fanta"
-            elif "nestle" in cc["class_name"].lower(): product_name = "Nestle"
-            elif "nescafe" in cc["class_name"].lower(): product_name = "Nescafe"
-            elif "ricamar" in cc["class_name"].lower(): product_name = "Ricamar"
-            
-            final_boxes.append({"bbox": cc["bbox"], "conf": cc["conf"], "name": product_name, "type": "custom"})
+    frame_stats = stats if stats is not None else [{} for _ in frames]
+    for fs in frame_stats:
+        fs["mode"] = INFERENCE_MODE
+        fs["second_pass"] = "full"
+    
+    groups = defaultdict(list)
+    for i, frame in enumerate(frames):
+        groups[inference_size(frame, is_video)].append(i)
+    
+    final_boxes = [None] * len(frames)
+    predict = PREDICTORS.get(INFERENCE_MODE, predict_sequential)
+    for inference_sz, indices in groups.items():
+        candidates = predict([frames[i] for i in indices], inference_sz, custom_conf, nano_conf, [frame_stats[i] for i in indices])
+        for i, (custom, nano) in zip(indices, candidates):
+            final_boxes[i] = merge_candidates(custom, nano)
+    
+    with STATS_LOCK:
+        DETECTION_STATS["frames"] += len(frames)
+        for fs in frame_stats:
+            DETECTION_STATS[f"second_pass_{fs['second_pass']}"] += 1
+    return final_boxes
+
+def run_detection_on_frame(image_raw, is_video=False, stats=None):
+    """Returns RAW detections without database lookups for speed."""
+    return run_detection_on_frames([image_raw], is_video, None if stats is None else [stats])[0]
+
+def merge_candidates(custom, nano):
+    """Priority merge of filtered custom-brand and nano candidates on IoU matrices."""
+    # 🛡️ PRIORITY 1: Custom Retail Brands (confidence floors already applied)
+    custom_boxes = custom["boxes"]
+    nano_boxes, nano_conf = nano["boxes"], nano["conf"]
+    dedup = NANO_CLASSES["dedup"][nano["cls"]]
 
     # 🛡️ PRIORITY 2: Produce & Market Items
-    for nc in nano_candidates:
-        should_skip = False
-        for b in final_boxes:
-            # Custom brands ALWAYS win over generic nano detections
-            if b["type"] == "custom" and calculate_iou(nc["bbox"], b["bbox"]) > 0.3:
-                should_skip = True
-                break
-        
-        if not should_skip:
-            # Deduplicate against existing nano detections for produce/market items
-            if nc["is_produce"] or nc["class_name"] in ["bed", "cell phone"]: # "bed" for fresh fish, "cell phone" for price tags
-                if any(calculate_iou(nc["bbox"], b["bbox"]) > 0.65 for b in final_boxes if b["type"] == "nano"):
-                    continue
-            
-            product_name = LABEL_MAPPINGS.get(nc["class_name"], nc["class_name"].title())
-            final_boxes.append({"bbox": nc["bbox"], "conf": nc["conf"], "name": product_name, "type": "nano"})
+    # Custom brands ALWAYS win over generic nano detections
+    passed = max_iou(nano_boxes, custom_boxes) <= 0.3
+    # Non-deduplicated items are always accepted; a produce item is dropped if an earlier accepted nano box overlaps it
+    always = np.flatnonzero(passed & ~dedup)
+    produce = np.flatnonzero(passed & dedup)
+    if produce.size and always.size:
+        earlier = always[None, :] < produce[:, None]
+        overlap = box_iou(nano_boxes[produce], nano_boxes[always]) > 0.65
+        produce = produce[~(overlap & earlier).any(axis=1)]
+    accepted = np.sort(np.concatenate([always, greedy_nms(nano_boxes, produce, 0.65)]).astype(np.int64))
 
     # 🛡️ PRIORITY 3: General Retail Items
-    remaining = sorted(nano_candidates, key=lambda x: x["conf"], reverse=True)
-    for r in remaining:
-        if any(calculate_iou(r["bbox"], b["bbox"]) > 0.5 for b in final_boxes): continue
-        if r["conf"] > 0.05: # Even lower threshold for general items
-            product_name = LABEL_MAPPINGS.get(r["class_name"], r["class_name"].title())
-            final_boxes.append({"bbox": r["bbox"], "conf": r["conf"], "name": product_name, "type": "nano"})
+    remaining = np.argsort(-nano_conf, kind="stable")
+    # Even lower threshold for general items
+    remaining = remaining[nano_conf[remaining] > 0.05]
+    remaining = remaining[max_iou(nano_boxes[remaining], np.concatenate([custom_boxes, nano_boxes[accepted]])) <= 0.5]
+    general = np.array(greedy_nms(nano_boxes, remaining, 0.5), dtype=np.int64)
 
+    # Python objects only for the survivors
+    final_boxes = [
+        {"bbox": bbox, "conf": conf, "name": name, "type": "custom"}
+        for bbox, conf, name in zip(custom_boxes.tolist(), custom["conf"].tolist(), CUSTOM_CLASSES["name"][custom["cls"]])
+    ]
+    for selected in (accepted, general):
+        final_boxes.extend(
+            {"bbox": bbox, "conf": conf, "name": name, "type": "nano"}
+            for bbox, conf, name in zip(nano_boxes[selected].tolist(), nano_conf[selected].tolist(), NANO_CLASSES["name"][nano["cls"][selected]])
+        )
     return final_boxes 
 
-def map_detections_to_db(boxes, db):
-    """Performs bulk database matching in one pass to avoid hangs."""
+def map_detections_to_db(boxes, db, all_products=None):
+    """Performs bulk database matching in one pass to avoid hangs (pass all_products to reuse one catalog load)."""
     if not boxes: return []
-    all_products = db.query(models.Product).all()
+    if all_products is None:
+        all_products = db.query(models.Product).all()
     name_lookup = {p.name.lower().strip(): p for p in all_products}
     norm_name_lookup = {p.name.lower().replace(" ", ""): p for p in all_products}
     
@@ -227,84 +601,787 @@ def map_detections_to_db(boxes, db):
         })
     return detections
 
+def fuse_boxes(all_boxes):
+    """
+    🧪 OPTIMIZED FUSION (V11): High-fidelity deduplication across sampled frames.
+    Class-aware greedy NMS by confidence: same-named items dedupe above 0.45 IoU,
+    different names only when highly overlapping (above 0.75).
+    """
+    if not all_boxes:
+        return []
+    boxes = np.array([b["bbox"] for b in all_boxes], dtype=np.float64)
+    conf = np.array([b["conf"] for b in all_boxes], dtype=np.float64)
+    labels = np.array([b["name"] for b in all_boxes], dtype=object)
+    keep = greedy_nms(boxes, np.argsort(-conf, kind="stable"), 0.45, labels=labels, cross_label_threshold=0.75)
+    return [all_boxes[i] for i in keep]
+
+def track_max_age(sample_seconds):
+    """Unmatched sampled frames spanning TRACK_MAX_AGE_SECONDS, so denser sampling keeps tracks as long in video time"""
+    return max(2, int(np.ceil(TRACK_MAX_AGE_SECONDS / max(sample_seconds, 1e-3))))
+
+class BoxTracker:
+    """
+    ByteTrack-style multi-object tracker over sampled video frames. Each track carries a
+    constant-velocity Kalman filter on (cx, cy, w, h); every frame, high-confidence detections are
+    matched to the predicted boxes first and low-confidence ones to the tracks left over.
+    Predictions are first shifted by the voted camera pan between frames. Unlike ByteTrack,
+    unmatched low-confidence detections still open tracks because the per-class floors in
+    filter_candidates already act as the noise gate. Cost per frame is
+    O(detections x live tracks), so a whole video is linear in its detections.
+    """
+    POSITION_STD = 1 / 20  # Noise scales with box size, as in ByteTrack
+    VELOCITY_STD = 1 / 160
+    TRANSITION = np.eye(8) + np.eye(8, k=4)
+    
+    def __init__(self, match_iou=TRACK_MATCH_IOU, cross_label_iou=TRACK_CROSS_LABEL_IOU,
+                 high_conf=TRACK_HIGH_CONF, max_age=track_max_age(VIDEO_SAMPLE_SECONDS)):
+        self.match_iou = match_iou
+        self.cross_label_iou = cross_label_iou
+        self.high_conf = high_conf
+        self.max_age = max_age
+        self.mean = np.zeros((0, 8))
+        self.cov = np.zeros((0, 8, 8))
+        self.ids = np.zeros(0, dtype=int)
+        self.missed = np.zeros(0, dtype=int)
+        self.tracks = {}  # track_id -> {"box": best detection so far, "hits": matched frames}
+        self.next_id = 1
+    
+    @staticmethod
+    def to_xywh(boxes):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        return np.column_stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2,
+                                boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]])
+    
+    @staticmethod
+    def to_xyxy(xywh):
+        half = xywh[:, 2:4] / 2
+        return np.column_stack([xywh[:, :2] - half, xywh[:, :2] + half])
+    
+    def size_std(self, wh, weight):
+        return np.tile(wh, 2) * weight  # (w, h, w, h) scaled
+    
+    def predict(self):
+        wh = self.mean[:, 2:4]
+        q = np.concatenate([self.size_std(wh, self.POSITION_STD), self.size_std(wh, self.VELOCITY_STD)], axis=1) ** 2
+        self.mean = self.mean @ self.TRANSITION.T
+        self.mean[:, 2:4] = np.maximum(self.mean[:, 2:4], 1.0)  # Shrinking velocity must not invert a box
+        self.cov = self.TRANSITION @ self.cov @ self.TRANSITION.T
+        self.cov[:, np.arange(8), np.arange(8)] += q
+    
+    def correct(self, rows, measured):
+        r = self.size_std(measured[:, 2:4], self.POSITION_STD) ** 2
+        cov = self.cov[rows]
+        innovation_cov = cov[:, :4, :4] + r[:, :, None] * np.eye(4)
+        gain = cov[:, :, :4] @ np.linalg.inv(innovation_cov)
+        innovation = measured - self.mean[rows, :4]
+        self.mean[rows] += (gain @ innovation[:, :, None])[:, :, 0]
+        self.cov[rows] = cov - gain @ innovation_cov @ gain.transpose(0, 2, 1)
+    
+    def initiate(self, measured, drift=np.zeros(2)):
+        n = len(measured)
+        wh = measured[:, 2:4]
+        std = np.concatenate([self.size_std(wh, 2 * self.POSITION_STD), self.size_std(wh, 10 * self.VELOCITY_STD)], axis=1)
+        cov = np.zeros((n, 8, 8))
+        cov[:, np.arange(8), np.arange(8)] = std ** 2
+        ids = np.arange(self.next_id, self.next_id + n)
+        self.next_id += n
+        velocity = np.zeros((n, 4))
+        velocity[:, :2] = drift
+        self.mean = np.concatenate([self.mean, np.column_stack([measured, velocity])])
+        self.cov = np.concatenate([self.cov, cov])
+        self.ids = np.concatenate([self.ids, ids])
+        self.missed = np.concatenate([self.missed, np.zeros(n, dtype=int)])
+        return ids
+    
+    def camera_shift(self, det_xywh, det_labels):
+        """
+        Global translation between the predicted tracks and this frame (camera pan), voted from
+        the centre offsets of every same-product pair. Zero unless enough pairs agree.
+        """
+        track_labels = np.array([self.tracks[i]["box"]["name"] for i in self.ids], dtype=object)
+        same = det_labels[:, None] == track_labels[None, :]
+        if not same.any():
+            return np.zeros(2)
+        offsets = (det_xywh[:, None, :2] - self.mean[None, :, :2])[same]
+        cell = max(float(np.median(det_xywh[:, 2:4].min(axis=1))) / 2, 1.0)
+        cells = np.round(offsets / cell).astype(np.int64)
+        _, first, votes = np.unique(cells[:, 0] * (1 << 32) + cells[:, 1], return_index=True, return_counts=True)
+        # Re-score the busiest cells (and "no pan" first, which wins ties) with a window that ignores cell edges
+        centers = np.vstack([np.zeros((1, 2)), cells[first[np.argsort(-votes)[:8]]] * cell])
+        distance = np.abs(offsets[None, :, :] - centers[:, None, :]).max(axis=2)
+        near = distance <= cell
+        best = int(np.argmax(near.sum(axis=1)))
+        # On a regular shelf a whole-facing shift also lines up with most boxes when some flicker out,
+        # so a pan has to clearly beat the pairs that sit closer to "no pan"
+        still = (near[0] & (distance[0] < distance[best])).sum()
+        if best == 0 or near[best].sum() < max(3, 0.3 * min(len(det_xywh), len(self.ids)), 2 * still):
+            return np.zeros(2)
+        return np.median(offsets[near[best]], axis=0)
+    
+    def associate(self, det_boxes, det_labels, det_rows, track_rows):
+        """Optimal IoU assignment between a detection subset and the still-free tracks"""
+        if len(det_rows) == 0 or len(track_rows) == 0:
+            return []
+        iou = box_iou(det_boxes[det_rows], self.to_xyxy(self.mean[track_rows, :4]))
+        track_labels = np.array([self.tracks[i]["box"]["name"] for i in self.ids[track_rows]], dtype=object)
+        same = det_labels[det_rows][:, None] == track_labels[None, :]
+        allowed = iou >= np.where(same, self.match_iou, max(self.match_iou, self.cross_label_iou))
+        rows, cols = linear_sum_assignment(np.where(allowed, 1.0 - iou, 2.0))
+        keep = allowed[rows, cols]
+        return list(zip(det_rows[rows[keep]], track_rows[cols[keep]]))
+    
+    def update(self, boxes):
+        """Associate one frame's boxes and return the track id assigned to each of them"""
+        if len(self.ids):
+            self.predict()
+        if not boxes:
+            self.missed += 1
+            self.prune()
+            return []
+        det_boxes = np.array([b["bbox"] for b in boxes], dtype=np.float64)
+        det_conf = np.array([b["conf"] for b in boxes], dtype=np.float64)
+        det_labels = np.array([b["name"] for b in boxes], dtype=object)
+        if len(self.ids):
+            self.mean[:, :2] += self.camera_shift(self.to_xywh(det_boxes), det_labels)
+        
+        assigned = np.full(len(boxes), -1)
+        free_tracks = np.arange(len(self.ids))
+        for stage in (det_conf >= self.high_conf, det_conf < self.high_conf):
+            det_rows = np.flatnonzero(stage)
+            det_rows = det_rows[np.argsort(-det_conf[det_rows], kind="stable")]
+            for det_row, track_row in self.associate(det_boxes, det_labels, det_rows, free_tracks):
+                assigned[det_row] = track_row
+            free_tracks = np.setdiff1d(free_tracks, assigned[assigned >= 0])
+        
+        matched = np.flatnonzero(assigned >= 0)
+        if len(matched):
+            self.correct(assigned[matched], self.to_xywh(det_boxes[matched]))
+        self.missed += 1
+        self.missed[assigned[matched]] = 0
+        
+        track_ids = np.zeros(len(boxes), dtype=int)
+        track_ids[matched] = self.ids[assigned[matched]]
+        new = np.flatnonzero(assigned < 0)
+        if len(new):
+            # New tracks start with the scene's current motion, so a pan does not outrun them before they are matched again
+            drift = np.median(self.mean[assigned[matched], 4:6], axis=0) if len(matched) else np.zeros(2)
+            track_ids[new] = self.initiate(self.to_xywh(det_boxes[new]), drift)
+        
+        for box, track_id in zip(boxes, track_ids.tolist()):
+            track = self.tracks.setdefault(track_id, {"box": box, "hits": 0})
+            track["hits"] += 1
+            if box["conf"] > track["box"]["conf"]:
+                track["box"] = box  # Best sighting decides the reported box and product name
+        self.prune()
+        return track_ids.tolist()
+    
+    def prune(self):
+        alive = self.missed <= self.max_age
+        if not alive.all():
+            self.mean, self.cov = self.mean[alive], self.cov[alive]
+            self.ids, self.missed = self.ids[alive], self.missed[alive]
+    
+    def results(self):
+        """One box per track (its best sighting), in track order"""
+        return [{**track["box"], "track_id": track_id, "hits": track["hits"]} for track_id, track in self.tracks.items()]
+
+@app.get("/api/detect/stats")
+def detection_stats():
+    """Cumulative inference counters, including how often the cascade skipped the nano pass"""
+    with STATS_LOCK:
+        counters = dict(DETECTION_STATS)
+    frames = counters.get("frames", 0)
+    return {
+        "mode": INFERENCE_MODE,
+        "backend": INFERENCE_BACKEND,
+        "int8": INFERENCE_INT8,
+        **counters,
+        "second_pass_skip_rate": round(counters.get("second_pass_skipped", 0) / frames, 4) if frames else 0.0,
+        "batching": REALTIME_BATCHER.report(),
+        "motion_gate": {"threshold": MOTION_GATE.threshold, "cameras": MOTION_GATE.report()}
+    }
+
+class MicroBatcher:
+    """
+    Cross-request dynamic batching for realtime frames. Requests enqueue their decoded frame and
+    await a future; one worker task takes the first waiting frame, collects more for up to
+    max_wait_ms or until max_size, runs a single run_detection_on_frames call off the event loop
+    and resolves each request with its own boxes. Frames arriving during inference form the
+    next batch, so batches grow with load while an idle server adds at most max_wait_ms.
+    """
+    def __init__(self, max_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self.max_size = max(1, max_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.queue = None
+        self.worker = None
+        self.loop = None
+        self.stats = defaultdict(float)
+    
+    def ensure_worker(self):
+        """Start the worker on first use (and again if the server's event loop was replaced)"""
+        loop = asyncio.get_running_loop()
+        if self.worker is None or self.worker.done() or self.loop is not loop:
+            self.loop = loop
+            self.queue = asyncio.Queue()
+            self.worker = loop.create_task(self.run())
+    
+    async def detect(self, image_raw):
+        """Returns (boxes, frame_stats) for one frame once its batch has been inferred"""
+        self.ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((image_raw, future, time.perf_counter()))
+        self.stats["requests"] += 1
+        self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], self.queue.qsize())
+        return await future
+    
+    async def collect(self):
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.queue.get_nowait() if remaining <= 0 else await asyncio.wait_for(self.queue.get(), remaining))
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+        return batch
+    
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [item for item in await self.collect() if not item[1].done()] # Skip clients that gave up
+            if not batch:
+                continue
+            started = time.perf_counter()
+            self.stats["batches"] += 1
+            self.stats["frames"] += len(batch)
+            self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(batch))
+            self.stats["queue_wait_ms"] += sum((started - enqueued) * 1000 for _, _, enqueued in batch)
+            frame_stats = [{"batch_size": len(batch)} for _ in batch]
+            try:
+                results = await loop.run_in_executor(None, run_detection_on_frames, [image for image, _, _ in batch], False, frame_stats)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done(): future.set_exception(e)
+                continue
+            self.stats["inference_ms"] += (time.perf_counter() - started) * 1000
+            for (_, future, _), boxes, fs in zip(batch, results, frame_stats):
+                if not future.done(): future.set_result((boxes, fs))
+    
+    def report(self):
+        stats = dict(self.stats)
+        batches, frames = stats.get("batches", 0), stats.get("frames", 0)
+        return {
+            "max_size": self.max_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "max_queue_depth": int(stats.get("max_queue_depth", 0)),
+            "requests": int(stats.get("requests", 0)),
+            "batches": int(batches),
+            "max_batch_size": int(stats.get("max_batch_size", 0)),
+            "avg_batch_size": round(frames / batches, 2) if batches else 0.0,
+            "avg_queue_wait_ms": round(stats.get("queue_wait_ms", 0) / frames, 2) if frames else 0.0,
+            "avg_inference_ms": round(stats.get("inference_ms", 0) / batches, 2) if batches else 0.0
+        }
+
+REALTIME_BATCHER = MicroBatcher()
+
+class MotionGate:
+    """
+    Per-camera change detection for live feeds. Each camera keeps a blurred low-resolution
+    greyscale thumbnail of the last frame that went through the models, plus that frame's
+    detections. A new frame whose thumbnail differs in fewer than `threshold` of its pixels
+    reuses the cached detections; the reference only moves when inference runs, so slow drift
+    still accumulates into a change, and max_age forces a periodic refresh.
+    """
+    def __init__(self, threshold=MOTION_THRESHOLD, max_age=MOTION_MAX_AGE_SECONDS, max_cameras=MOTION_MAX_CAMERAS):
+        self.threshold = threshold
+        self.max_age = max_age
+        self.max_cameras = max_cameras
+        self.cameras = OrderedDict()  # camera_id -> reference, detections, counters (LRU)
+    
+    @staticmethod
+    def thumbnail(image_raw):
+        h, w = image_raw.shape[:2]
+        size = (MOTION_THUMB_WIDTH, max(1, round(h * MOTION_THUMB_WIDTH / w)))
+        grey = cv2.cvtColor(cv2.resize(image_raw, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(grey, (3, 3), 0)  # Suppresses sensor noise and JPEG artefacts
+    
+    def camera(self, camera_id):
+        state = self.cameras.get(camera_id)
+        if state is None:
+            state = self.cameras[camera_id] = {"reference": None, "frames": 0, "skipped": 0, "last_change": None}
+            while len(self.cameras) > self.max_cameras:
+                self.cameras.popitem(last=False)
+        self.cameras.move_to_end(camera_id)
+        return state
+    
+    def lookup(self, camera_id, shape, thumb):
+        """Cached (detections, inference info) when the scene is unchanged, else None"""
+        state = self.camera(camera_id)
+        state["frames"] += 1
+        reference = state["reference"]
+        if reference is None or reference["shape"] != shape or time.monotonic() - reference["at"] > self.max_age:
+            return None
+        changed = float(np.count_nonzero(cv2.absdiff(thumb, reference["thumb"]) > MOTION_PIXEL_DELTA)) / thumb.size
+        state["last_change"] = round(changed, 4)
+        if changed >= self.threshold:
+            return None
+        state["skipped"] += 1
+        return reference["detections"], {**reference["inference"], "cached": True, "changed_fraction": round(changed, 4)}
+    
+    def store(self, camera_id, shape, thumb, detections, inference):
+        self.camera(camera_id)["reference"] = {
+            "shape": shape, "thumb": thumb, "detections": detections, "inference": inference, "at": time.monotonic()
+        }
+    
+    def report(self):
+        return {
+            str(camera_id): {
+                "frames": state["frames"],
+                "skipped": state["skipped"],
+                "skip_rate": round(state["skipped"] / state["frames"], 4) if state["frames"] else 0.0,
+                "last_change": state["last_change"]
+            }
+            for camera_id, state in list(self.cameras.items())
+        }
+
+MOTION_GATE = MotionGate()
+
+_roi_cache = {}
+_roi_cache_lock = threading.Lock()
+
+def valid_roi_polygons(polygons):
+    """Keep only polygons of at least 3 numeric [x, y] points; None if nothing usable remains"""
+    if not isinstance(polygons, list):
+        return None
+    valid = [
+        polygon for polygon in polygons
+        if isinstance(polygon, list) and len(polygon) >= 3 and all(
+            isinstance(point, list) and len(point) == 2
+            and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in point)
+            for point in polygon
+        )
+    ]
+    return valid or None
+
+def get_camera_roi(camera_id):
+    """Shelf polygons (0-1 frame coordinates) registered for a numeric camera id, cached briefly"""
+    if camera_id is None or not str(camera_id).isdigit():
+        return None
+    camera_id = int(camera_id)
+    with _roi_cache_lock:
+        cached = _roi_cache.get(camera_id)
+    if cached is not None and time.monotonic() - cached[0] < ROI_CACHE_SECONDS:
+        return cached[1]
+    db = SessionLocal()
+    try:
+        camera = db.query(models.Camera).filter(models.Camera.id == camera_id).first()
+        polygons = valid_roi_polygons(json.loads(camera.roi)) if camera is not None and camera.roi else None
+    except (ValueError, TypeError) as e:
+        print(f"⚠️ Ignoring invalid ROI for camera {camera_id}: {e}")
+        polygons = None
+    finally:
+        db.close()
+    with _roi_cache_lock:
+        _roi_cache[camera_id] = (time.monotonic(), polygons)
+    return polygons
+
+def crop_to_roi(image_raw, polygons):
+    """Crop to the bounding box of the ROI polygons; returns (crop, roi info) or (frame, None)"""
+    h, w = image_raw.shape[:2]
+    pixel_polygons = [np.asarray(polygon, dtype=np.float64) * np.array([w, h]) for polygon in polygons]
+    points = np.concatenate(pixel_polygons)
+    x0, y0 = np.floor(points.min(axis=0)).clip(0, [w, h]).astype(int)
+    x1, y1 = np.ceil(points.max(axis=0)).clip(0, [w, h]).astype(int)
+    if x1 - x0 < 32 or y1 - y0 < 32:
+        return image_raw, None
+    return image_raw[y0:y1, x0:x1], {"offset": (int(x0), int(y0)), "polygons": pixel_polygons, "crop": [int(x0), int(y0), int(x1), int(y1)]}
+
+def points_in_polygons(points, polygons):
+    """Even-odd ray casting of (n, 2) points against several polygons; True if inside any"""
+    inside_any = np.zeros(len(points), dtype=bool)
+    px, py = points[:, 0][:, None], points[:, 1][:, None]
+    for polygon in polygons:
+        x_a, y_a = polygon[:, 0][None, :], polygon[:, 1][None, :]
+        x_b, y_b = np.roll(polygon[:, 0], -1)[None, :], np.roll(polygon[:, 1], -1)[None, :]
+        crosses = (y_a > py) != (y_b > py)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_cross = x_a + (py - y_a) * (x_b - x_a) / (y_b - y_a)
+        inside_any |= (np.count_nonzero(crosses & (px < x_cross), axis=1) % 2).astype(bool)
+    return inside_any
+
+def boxes_from_roi(boxes, roi):
+    """Map boxes detected on the ROI crop back to the frame, keeping those centred inside a polygon"""
+    if roi is None or not boxes:
+        return boxes
+    dx, dy = roi["offset"]
+    shifted = [{**box, "bbox": [box["bbox"][0] + dx, box["bbox"][1] + dy, box["bbox"][2] + dx, box["bbox"][3] + dy]} for box in boxes]
+    coords = np.array([box["bbox"] for box in shifted], dtype=np.float64)
+    centres = np.column_stack([(coords[:, 0] + coords[:, 2]) / 2, (coords[:, 1] + coords[:, 3]) / 2])
+    inside = points_in_polygons(centres, roi["polygons"])
+    return [box for box, keep in zip(shifted, inside) if keep]
+
+def decode_image(contents):
+    return cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
+
+def prepare_camera_frame(contents, camera_id):
+    """Decode, crop to the camera's ROI and build the motion thumbnail (of the crop) in one threadpool hop"""
+    image_raw = decode_image(contents)
+    if image_raw is None:
+        return None, None, None
+    polygons = get_camera_roi(camera_id)
+    image_raw, roi = crop_to_roi(image_raw, polygons) if polygons else (image_raw, None)
+    return image_raw, MotionGate.thumbnail(image_raw), roi
+
+def map_detections_with_session(boxes):
+    db = SessionLocal()
+    try:
+        return map_detections_to_db(boxes, db)
+    finally:
+        db.close()
+
 @app.post("/api/detect/realtime")
-def detect_retail(file: UploadFile = File(...)):
+async def detect_retail(file: UploadFile = File(...), camera_id: Optional[str] = Form(None)):
     print(f"📥 Received high-density image request: {file.filename}", flush=True)
     try:
-        contents = file.file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        image_raw = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        contents = await file.read()
+        if camera_id is None:
+            image_raw, thumb, roi = await run_in_threadpool(decode_image, contents), None, None
+        else:
+            # 🎯 Cameras with a registered ROI only send their shelf region through the models
+            image_raw, thumb, roi = await run_in_threadpool(prepare_camera_frame, contents, camera_id)
         if image_raw is None: return {"status": "error", "message": "Decode failed"}
         
+        # 💤 Live feeds: an unchanged scene reuses the camera's last detections
+        if camera_id is not None:
+            cached = MOTION_GATE.lookup(camera_id, image_raw.shape, thumb)
+            if cached is not None:
+                detections, frame_stats = cached
+                print(f"💤 Camera {camera_id} unchanged ({frame_stats['changed_fraction']}), reusing {len(detections)} items", flush=True)
+                return {"success": True, "detections": detections, "inference": frame_stats}
+        
+        # ⚡ Frames from concurrent requests share one batched model call
+        raw_boxes, frame_stats = await REALTIME_BATCHER.detect(image_raw)
+        if roi is not None:
+            kept = boxes_from_roi(raw_boxes, roi)
+            frame_stats = {**frame_stats, "roi": roi["crop"], "outside_roi": len(raw_boxes) - len(kept)}
+            raw_boxes = kept
+        detections = await run_in_threadpool(map_detections_with_session, raw_boxes)
+        if camera_id is not None:
+            MOTION_GATE.store(camera_id, image_raw.shape, thumb, detections, frame_stats)
+        print(f"🎯 Zero-Lag Identify: {len(detections)} items", flush=True)
+        return {"success": True, "detections": detections, "inference": frame_stats}
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return {"status": "error", "message": str(e)}
+
+def count_detections(detections):
+    """Aggregate mapped detections into per-product counts, most frequent first"""
+    counts = Counter((d["product_name"], d["product_id"]) for d in detections)
+    return [
+        {"product_name": name, "product_id": product_id, "product_exists": product_id is not None, "count": count}
+        for (name, product_id), count in counts.most_common()
+    ]
+
+@app.post("/api/detect/batch")
+def detect_batch(files: List[UploadFile] = File(...), mode: str = "full"):
+    """
+    Bulk audit of many shelf photos in one request. Images run through the models in batches of
+    BATCH_MAX_SIZE. mode="full" returns per-image detections plus totals; mode="counts" returns
+    only the aggregated per-product counts.
+    """
+    print(f"📥 Received bulk image request: {len(files)} images ({mode})", flush=True)
+    if mode not in ("full", "counts"):
+        return {"status": "error", "message": "mode must be 'full' or 'counts'"}
+    if len(files) > BULK_MAX_IMAGES:
+        return {"status": "error", "message": f"At most {BULK_MAX_IMAGES} images per request"}
+    
+    try:
+        images, failed = [], []
+        for file in files:
+            image_raw = decode_image(file.file.read())
+            if image_raw is None:
+                failed.append(file.filename)
+            else:
+                images.append((file.filename, image_raw))
+        
+        started = time.perf_counter()
+        raw_boxes, frame_stats = [], []
+        for i in range(0, len(images), BATCH_MAX_SIZE):
+            chunk_stats = [{} for _ in images[i:i + BATCH_MAX_SIZE]]
+            raw_boxes.extend(run_detection_on_frames([image for _, image in images[i:i + BATCH_MAX_SIZE]], stats=chunk_stats))
+            frame_stats.extend(chunk_stats)
+        elapsed = time.perf_counter() - started
+        
         db = SessionLocal()
         try:
-            raw_boxes = run_detection_on_frame(image_raw)
-            detections = map_detections_to_db(raw_boxes, db)
-            print(f"🎯 Zero-Lag Identify: {len(detections)} items", flush=True)
-            return {"success": True, "detections": detections}
+            all_products = db.query(models.Product).all()
+            per_image = [map_detections_to_db(boxes, db, all_products) for boxes in raw_boxes]
         finally:
             db.close()
+        
+        all_detections = [d for detections in per_image for d in detections]
+        print(f"🎯 Bulk Identify: {len(all_detections)} items across {len(images)} images in {elapsed:.2f}s", flush=True)
+        response = {
+            "success": True,
+            "images": len(images),
+            "failed": failed,
+            "total_items": len(all_detections),
+            "counts": count_detections(all_detections),
+            "elapsed_seconds": round(elapsed, 3)
+        }
+        if mode == "full":
+            response["results"] = [
+                {"filename": filename, "detections": detections, "inference": fs}
+                for (filename, _), detections, fs in zip(images, per_image, frame_stats)
+            ]
+        return response
     except Exception as e:
-        print(f"❌ Error: {e}")
+        print(f"❌ Bulk Detection Error: {e}")
         return {"status": "error", "message": str(e)}
 
-@app.post("/api/detect/video")
-def detect_video(file: UploadFile = File(...)):
-    print(f"📥 Received v10 high-fidelity video request: {file.filename}", flush=True)
-    temp_file = f"temp_{file.filename}"
+def read_sampled_frames(cap, frame_indices, frames_out, stop, job_stats):
+    """
+    Reader thread: decode sequentially, grab() past unsampled frames instead of seeking,
+    and queue (frame_idx, frame) for sampled ones. None marks the end of the stream.
+    """
+    def put(item):
+        while not stop.is_set():
+            try:
+                frames_out.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    start = position = frame_indices[0] if frame_indices else 0
     try:
-        with open(temp_file, "wb") as f: f.write(file.file.read())
-        cap = cv2.VideoCapture(temp_file)
-        if not cap.isOpened(): return {"status": "error", "message": "Video open failed"}
+        if start > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start) # One seek to the first sample only
+        for frame_idx in frame_indices:
+            while position < frame_idx:
+                if not cap.grab(): return
+                position += 1
+            ret, frame = cap.read()
+            position += 1
+            if not ret or not put((frame_idx, frame)): return
+    finally:
+        job_stats["decoded_frames"] = position - start
+        put(None)
+
+def iter_video_detections(cap, frame_indices, job_stats, batch_size=VIDEO_BATCH_SIZE):
+    """
+    Yield (frame_idx, boxes) for the sampled frames: a reader thread prefetches decoded frames
+    into a bounded queue while YOLO runs on batches of up to batch_size frames.
+    Throughput is written to job_stats when the scan ends.
+    """
+    frames_in = queue.Queue(maxsize=VIDEO_PREFETCH)
+    stop = threading.Event()
+    reader = threading.Thread(target=read_sampled_frames, args=(cap, frame_indices, frames_in, stop, job_stats), daemon=True)
+    started = time.perf_counter()
+    sampled = 0
+    reader.start()
+    try:
+        batch = []
+        done = False
+        while not done:
+            item = frames_in.get()
+            if item is None:
+                done = True
+            else:
+                batch.append(item)
+            if batch and (done or len(batch) >= batch_size):
+                batch_boxes = run_detection_on_frames([frame for _, frame in batch], is_video=True)
+                sampled += len(batch)
+                for (frame_idx, _), frame_boxes in zip(batch, batch_boxes):
+                    yield frame_idx, frame_boxes
+                batch = []
+    finally:
+        stop.set()
+        reader.join(timeout=5)
+        elapsed = time.perf_counter() - started
+        job_stats["sampled_frames"] = sampled
+        job_stats["elapsed_seconds"] = round(elapsed, 3)
+        job_stats["fps"] = round(sampled / elapsed, 2) if elapsed > 0 else 0.0  # Sampled frames inferred per second
+        job_stats["scan_fps"] = round(job_stats.get("decoded_frames", 0) / elapsed, 2) if elapsed > 0 else 0.0  # Video frames covered per second
+
+_segment_pool = None
+_segment_pool_lock = threading.Lock()
+
+def init_segment_worker(threads):
+    """Split the cores between segment workers instead of letting each grab all of them"""
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(1)
+
+def get_segment_pool():
+    """Lazily started, reused worker processes (each loads the models once)"""
+    global _segment_pool
+    with _segment_pool_lock:
+        if _segment_pool is None:
+            threads = max(1, (os.cpu_count() or 1) // VIDEO_WORKERS)
+            _segment_pool = ProcessPoolExecutor(
+                max_workers=VIDEO_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"), # Fork is unsafe with torch thread pools
+                initializer=init_segment_worker,
+                initargs=(threads,)
+            )
+        return _segment_pool
+
+def scan_video_segment(video_path, frame_indices):
+    """Worker process: decode and detect one time segment of the video with its own capture"""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        segment_stats = {}
+        frames = list(iter_video_detections(cap, frame_indices, segment_stats))
+        return frames, segment_stats
+    finally:
+        cap.release()
+
+def scan_video_segments(video_path, frame_indices, job_stats):
+    """
+    Split the sampled frames into contiguous time segments, one per worker process, and yield
+    every (frame_idx, boxes) in frame order as each segment completes.
+    """
+    segments = [list(chunk) for chunk in np.array_split(np.asarray(frame_indices, dtype=int), VIDEO_WORKERS) if len(chunk)]
+    started = time.perf_counter()
+    pool = get_segment_pool()
+    futures = [pool.submit(scan_video_segment, video_path, [int(i) for i in segment]) for segment in segments]
+    
+    try:
+        for future in futures:
+            segment_frames, segment_stats = future.result()
+            for key in ("decoded_frames", "sampled_frames"):
+                job_stats[key] = job_stats.get(key, 0) + segment_stats.get(key, 0)
+            yield from segment_frames
+    finally:
+        for future in futures: future.cancel() # Client went away: drop segments not yet started
+        elapsed = time.perf_counter() - started
+        job_stats["segments"] = len(segments)
+        job_stats["elapsed_seconds"] = round(elapsed, 3)
+        job_stats["fps"] = round(job_stats.get("sampled_frames", 0) / elapsed, 2) if elapsed > 0 else 0.0
+        job_stats["scan_fps"] = round(job_stats.get("decoded_frames", 0) / elapsed, 2) if elapsed > 0 else 0.0
+
+def spool_upload(file):
+    """Copy the upload to a unique temp file in fixed-size chunks, keeping memory bounded"""
+    suffix = os.path.splitext(file.filename or "")[1]
+    fd, temp_file = tempfile.mkstemp(prefix="yolo_video_", suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(file.file, f, UPLOAD_CHUNK_BYTES)
+    except Exception:
+        remove_temp_file(temp_file)
+        raise
+    return temp_file
+
+def remove_temp_file(path):
+    if os.path.exists(path): os.remove(path)
+
+def iter_video_scan(temp_file):
+    """
+    Yield scan events for a spooled video: "start", one "frame" per sampled frame with its own
+    detections as soon as they are inferred, then a "summary" with the fused detections and stats
+    (or a single "error"). The temp file is removed when the scan ends.
+    """
+    cap = cv2.VideoCapture(temp_file)
+    db = SessionLocal()
+    try:
+        if not cap.isOpened():
+            yield {"event": "error", "status": "error", "message": "Video open failed"}
+            return
         
         fps = cap.get(cv2.CAP_PROP_FPS)
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        if total_frames <= 0 or fps <= 0: return {"status": "error", "message": "Invalid video data"}
+        if total_frames <= 0 or fps <= 0:
+            yield {"event": "error", "status": "error", "message": "Invalid video data"}
+            return
         
-        # 🧪 HIGH-FIDELITY SAMPLING: Every 1.5 seconds, capped at 50 frames
-        num_samples = 50
-        sample_interval = max(int(fps * 1.5), int(total_frames / num_samples))
+        # 🧪 HIGH-FIDELITY SAMPLING: Every 1.5 seconds by default, capped at 50 frames
+        num_samples = VIDEO_MAX_SAMPLES
+        sample_interval = max(int(fps * VIDEO_SAMPLE_SECONDS), int(total_frames / num_samples), 1)
         
-        print(f"🎥 Scanning: {num_samples} frames (1 per {sample_interval} frames) at 1280px", flush=True)
+        print(f"🎥 Scanning: {num_samples} frames (1 per {sample_interval} frames) at 1280px, batches of {VIDEO_BATCH_SIZE}, {VIDEO_FUSION} fusion", flush=True)
         all_boxes = []
+        tracker = BoxTracker(max_age=track_max_age(sample_interval / fps)) if VIDEO_FUSION == "track" else None
+        job_stats = {"total_frames": total_frames, "sample_interval": sample_interval, "fusion": VIDEO_FUSION}
+        frame_indices = list(range(0, total_frames, sample_interval))
+        all_products = db.query(models.Product).all()
+        yield {"event": "start", "total_frames": total_frames, "fps": fps, "sampled_frames": len(frame_indices)}
         
-        for frame_idx in range(0, total_frames, sample_interval):
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-            ret, frame = cap.read()
-            if not ret: continue
-            
-            frame_boxes = run_detection_on_frame(frame, is_video=True)
-            all_boxes.extend(frame_boxes)
-            print(f"   🎞️ Sampled Frame {frame_idx}/{total_frames}: Found {len(frame_boxes)} items", flush=True)
-            
-        # 🧪 OPTIMIZED FUSION (V11): High-fidelity deduplication
-        unique_boxes = []
-        all_boxes.sort(key=lambda x: x["conf"], reverse=True)
+        # ⚡ Long videos: decode and detect time segments in parallel worker processes
+        if VIDEO_WORKERS > 1 and total_frames / fps >= VIDEO_SEGMENT_MIN_SECONDS:
+            print(f"⚡ Splitting into {VIDEO_WORKERS} segments across worker processes", flush=True)
+            frames = scan_video_segments(os.path.abspath(temp_file), frame_indices, job_stats)
+        else:
+            frames = iter_video_detections(cap, frame_indices, job_stats)
         
-        for b in all_boxes:
-            is_overlap = False
-            for u in unique_boxes:
-                # Strictly deduplicate same-named items or highly overlapping boxes
-                iou_threshold = 0.45 if b["name"] == u["name"] else 0.75
-                if calculate_iou(b["bbox"], u["bbox"]) > iou_threshold:
-                    is_overlap = True
-                    break
-            if not is_overlap:
-                unique_boxes.append(b)
-
-        db = SessionLocal()
         try:
-            detections = map_detections_to_db(unique_boxes, db)
-            print(f"🎯 Total Video Coverage (V10): {len(detections)} high-fidelity items", flush=True)
-            return {"success": True, "detections": detections}
+            for done, (frame_idx, frame_boxes) in enumerate(frames, start=1):
+                print(f"   🎞️ Sampled Frame {frame_idx}/{total_frames}: Found {len(frame_boxes)} items", flush=True)
+                frame_detections = map_detections_to_db(frame_boxes, db, all_products)
+                if tracker: # Segments arrive in frame order, so tracks carry across segment boundaries
+                    for detection, track_id in zip(frame_detections, tracker.update(frame_boxes)):
+                        detection["track_id"] = track_id
+                else:
+                    all_boxes.extend(frame_boxes)
+                yield {
+                    "event": "frame",
+                    "frame_idx": frame_idx,
+                    "timestamp": round(frame_idx / fps, 3),
+                    "progress": round(done / len(frame_indices), 4),
+                    "detections": frame_detections
+                }
         finally:
-            db.close()
-            cap.release()
+            frames.close() # Stops the reader thread / segment workers if the client disconnected
+            
+        unique_boxes = tracker.results() if tracker else fuse_boxes(all_boxes)
+        print(f"⏱️ Video throughput: {job_stats['fps']} sampled fps, {job_stats['scan_fps']} video fps", flush=True)
+        detections = map_detections_to_db(unique_boxes, db, all_products)
+        for detection, box in zip(detections, unique_boxes):
+            if "track_id" in box:
+                detection["track_id"], detection["frames"] = box["track_id"], box["hits"]
+        counts = Counter(d["product_name"] for d in detections)
+        print(f"🎯 Total Video Coverage (V10): {len(detections)} high-fidelity items", flush=True)
+        yield {"event": "summary", "success": True, "detections": detections, "counts": dict(counts), "stats": job_stats}
     except Exception as e:
         print(f"❌ Video Deep Scan Error: {e}")
-        return {"status": "error", "message": str(e)}
+        yield {"event": "error", "status": "error", "message": str(e)}
     finally:
-        if os.path.exists(temp_file): os.remove(temp_file)
+        db.close()
+        cap.release()
+        remove_temp_file(temp_file)
+
+def ndjson_events(events):
+    for event in events:
+        yield json.dumps(event) + "\n"
+
+@app.post("/api/detect/video")
+def detect_video(file: UploadFile = File(...), stream: bool = False):
+    """
+    Deep video scan. With ?stream=true the response is NDJSON: one event per line as frames
+    are inferred ("start", "frame"..., then "summary" or "error"); otherwise only the summary.
+    """
+    print(f"📥 Received v10 high-fidelity video request: {file.filename}", flush=True)
+    try:
+        temp_file = spool_upload(file)
+    except Exception as e:
+        print(f"❌ Video Upload Error: {e}")
+        return {"status": "error", "message": str(e)}
+    
+    events = iter_video_scan(temp_file)
+    if stream:
+        # The generator cleans up after itself; the background task covers a client that never started reading
+        return StreamingResponse(
+            ndjson_events(events),
+            media_type="application/x-ndjson",
+            background=BackgroundTask(remove_temp_file, temp_file)
+        )
+    
+    result = None
+    for event in events:
+        if event["event"] in ("summary", "error"):
+            result = event
+    result.pop("event")
+    return result
 
 if __name__ == "__main__":
     import uvicorn
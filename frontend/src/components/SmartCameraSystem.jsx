@@ -239,6 +239,11 @@ const SmartCameraSystem = ({ locationId = 1, onInventoryUpdate }) => {
                                 const formData = new FormData();
                                 formData.append('file', blob, 'frame.jpg');
                                 formData.append('location_id', locationId);
+                                // Registered cameras send their id so the server applies their ROI; all of them get motion gating
+                                const detectCamId = (selectedCamera && typeof selectedCamera.id === 'number')
+                                    ? selectedCamera.id
+                                    : `${locationId}:${selectedCamera?.deviceId ?? 'default'}`;
+                                formData.append('camera_id', detectCamId);
 
                                 const response = await apiService.yolov8Detect(formData);
                                 if (response.data && response.data.success) {
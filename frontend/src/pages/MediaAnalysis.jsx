@@ -26,6 +26,7 @@ const MediaAnalysis = () => {
     const [videoReady, setVideoReady] = useState(false);
     const lastAnalysisTime = useRef(0);
     const [isAnalyzing, setIsAnalyzing] = useState(false);
+    const [scanProgress, setScanProgress] = useState(null); // Fraction of sampled video frames scanned so far
     const [isLiveAnalyzing, setIsLiveAnalyzing] = useState(false);
     const [results, setResults] = useState([]);
     const [products, setProducts] = useState([]);
@@ -155,8 +156,20 @@ const MediaAnalysis = () => {
                     console.log("📸 Calling Image AI Server...");
                     res = await apiService.yolov8Detect(formData);
                 } else {
-                    console.log("🎥 Calling Video AI Server...");
-                    res = await apiService.detectVideo(formData);
+                    console.log("🎥 Streaming Video AI Server results...");
+                    // Show the best sighting of each product as frames arrive; the fused summary replaces it at the end
+                    const provisional = new Map();
+                    setScanProgress(0);
+                    const finalEvent = await apiService.detectVideoStream(formData, (event) => {
+                        if (event.event !== 'frame') return;
+                        for (const det of event.detections) {
+                            const seen = provisional.get(det.product_name);
+                            if (!seen || det.confidence > seen.confidence) provisional.set(det.product_name, det);
+                        }
+                        setScanProgress(event.progress);
+                        setResults(toDisplayDetections([...provisional.values()]));
+                    });
+                    res = { data: finalEvent || { status: 'error', message: 'Video scan ended without a result' } };
                 }
 
                 console.log("🔍 AI RAW Response:", res.data);
@@ -167,24 +180,7 @@ const MediaAnalysis = () => {
 
                 if (detections && Array.isArray(detections)) {
                     console.log(`✅ Found ${detections.length} detections, processing...`);
-                    let processed = detections.map(det => ({
-                        ...det,
-                        displayName: det.product_name || (det.class_name ? det.class_name.charAt(0).toUpperCase() + det.class_name.slice(1) : 'Unknown'),
-                        score: det.confidence,
-                        similarity: det.confidence,
-                        class: det.class_name,
-                        bbox: [det.bbox.x1, det.bbox.y1, det.bbox.x2 - det.bbox.x1, det.bbox.y2 - det.bbox.y1],
-                        identifiedProduct: det.product_exists ? {
-                            product_id: det.product_id,
-                            product_name: det.product_name
-                        } : null
-                    }));
-
-                    // Apply Strict Mode filtering for Server-side AI too
-                    if (isStrictMode) {
-                        processed = processed.filter(det => det.product_exists);
-                    }
-
+                    const processed = toDisplayDetections(detections);
                     setResults(processed);
 
                     // Redraw canvas for High-Precision results
@@ -221,9 +217,29 @@ const MediaAnalysis = () => {
             setResults([]);
         } finally {
             setIsAnalyzing(false);
+            setScanProgress(null);
         }
     };
 
+    // Server-side detections -> the shape shared with browser-side results
+    const toDisplayDetections = (detections) => {
+        const processed = detections.map(det => ({
+            ...det,
+            displayName: det.product_name || (det.class_name ? det.class_name.charAt(0).toUpperCase() + det.class_name.slice(1) : 'Unknown'),
+            score: det.confidence,
+            similarity: det.confidence,
+            class: det.class_name,
+            bbox: [det.bbox.x1, det.bbox.y1, det.bbox.x2 - det.bbox.x1, det.bbox.y2 - det.bbox.y1],
+            identifiedProduct: det.product_exists ? {
+                product_id: det.product_id,
+                product_name: det.product_name
+            } : null
+        }));
+
+        // Apply Strict Mode filtering for Server-side AI too
+        return isStrictMode ? processed.filter(det => det.product_exists) : processed;
+    };
+
     const processDetections = async (preds, source) => {
         const processed = [];
 
@@ -759,7 +775,7 @@ const MediaAnalysis = () => {
                                     className="flex-1 flex items-center justify-center gap-2 py-3 bg-primary-600 text-white rounded-xl font-semibold hover:bg-primary-700 transition-all disabled:opacity-50 disabled:cursor-not-allowed"
                                 >
                                     {isAnalyzing ? (
-                                        <><Loader2 className="w-5 h-5 animate-spin" /> Analyzing...</>
+                                        <><Loader2 className="w-5 h-5 animate-spin" /> Analyzing{scanProgress !== null ? ` ${Math.round(scanProgress * 100)}%` : ''}...</>
                                     ) : (
                                         <><Zap className="w-5 h-5" /> {useHighPrecision ? 'Run High-Precision AI' : 'Start Quick AI Analysis'}</>
                                     )}
@@ -97,6 +97,7 @@ export const apiService = {
     },
     detectProduct: (data) => api.post('/api/camera/detect', data),
     createCamera: (data) => api.post('/api/cameras/', data),
+    updateCameraRoi: (cameraId, polygons) => api.put(`/api/cameras/${cameraId}/roi`, { polygons }),
 
     // Footages
     getFootages: (params) => api.get('/api/footages/', { params }),
@@ -138,6 +139,43 @@ export const apiService = {
             headers: { 'Content-Type': 'multipart/form-data' },
             timeout: 300000 // 5 minute timeout for deep video scans
         });
+    },
+    // Bulk audit: many images in one request; mode 'counts' returns only per-product totals
+    detectBatch: (files, mode = 'full') => {
+        const formData = new FormData();
+        files.forEach(file => formData.append('files', file));
+        return axios.post(`http://127.0.0.1:8001/api/detect/batch?mode=${mode}`, formData, {
+            headers: { 'Content-Type': 'multipart/form-data' },
+            timeout: 300000
+        });
+    },
+    // Streams NDJSON scan events ("start", "frame"..., then "summary" or "error") to onEvent as they arrive
+    detectVideoStream: async (formData, onEvent, signal) => {
+        const response = await fetch('http://127.0.0.1:8001/api/detect/video?stream=true', {
+            method: 'POST',
+            body: formData,
+            signal
+        });
+        if (!response.ok || !response.body) {
+            throw new Error(`Video scan failed with status ${response.status}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let last = null;
+        for (;;) {
+            const { value, done } = await reader.read();
+            buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+            const lines = buffer.split('\n');
+            buffer = done ? '' : lines.pop();
+            for (const line of lines) {
+                if (!line.trim()) continue;
+                last = JSON.parse(line);
+                onEvent(last);
+            }
+            if (done) return last;
+        }
     }
 };
 